@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+
+# Pongo a disposición pública este script bajo el término de "software de dominio público".
+# Puedes hacer lo que quieras con él porque es libre de verdad; no libre con condiciones como las licencias GNU y otras patrañas similares.
+# Si se te llena la boca hablando de libertad entonces hazlo realmente libre.
+# No tienes que aceptar ningún tipo de términos de uso o licencia para utilizarlo o modificarlo porque va sin CopyLeft.
+
+# ----------
+# Script de NiPeGun para medir el rendimiento de tsmdownloader.py y tsmeraser.py sin conexión a Telegram
+#
+# Usa un cliente de Telegram falso que genera mensajes sintéticos en memoria, así que se puede
+# ejecutar en cualquier portátil sin red ni cuenta. Necesita el repo clonado porque carga los
+# scripts hermanos desde ../telegram-saved-messages-downloader y ../telegram-saved-messages-eraser
+#
+# Ejecución:
+#   python3 ./tsmbench.py --messages 5000 --media-ratio 0.3 --latency-ms 40 --bandwidth-mbps 20
+# ----------
+
+import argparse
+import asyncio
+import bisect
+import importlib.util
+import json
+import logging
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import replace
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+cDirectorioRepo = Path(__file__).resolve().parent.parent
+cRutaDownloader = cDirectorioRepo / "telegram-saved-messages-downloader" / "tsmdownloader.py"
+cRutaEraser = cDirectorioRepo / "telegram-saved-messages-eraser" / "tsmeraser.py"
+
+def fCargarScript(pNombre: str, pRuta: Path):
+  vSpec = importlib.util.spec_from_file_location(pNombre, pRuta)
+  vModulo = importlib.util.module_from_spec(vSpec)
+  # Registrado en sys.modules para que sus funciones se puedan enviar a procesos hijos
+  sys.modules[pNombre] = vModulo
+  vSpec.loader.exec_module(vModulo)
+  return vModulo
+
+mDownloader = fCargarScript("tsmdownloader", cRutaDownloader)
+mEraser = fCargarScript("tsmeraser", cRutaEraser)
+
+# Los scripts ya no comprueban sus dependencias al importarse; se usa su bloque para tener telethon y rich
+mDownloader.fAsegurarDependencias()
+
+from rich.console import Console
+from rich.table import Table
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import DeleteHistoryRequest
+from telethon.tl.functions.messages import SearchRequest
+
+console = Console()
+
+@dataclass
+class ConfigFalsa:
+  mensajes: int
+  media_ratio: float
+  texto_ratio: float
+  media_min_kb: int
+  media_max_kb: int
+  latencia_ms: float
+  ancho_banda_mbps: Optional[float]
+  flood_prob: float
+  flood_segundos: int
+  flood_sleep_threshold: int
+  tamano_pagina: int
+  tramo_historial: int
+  semilla: int
+
+class ArchivoFalso:
+  __slots__ = ("name", "size")
+
+  # Lo que Telethon deduciría del tipo MIME; aquí todo es binario
+  ext = ".bin"
+
+  def __init__(self, pNombre: Optional[str], pTamano: int):
+    self.name = pNombre
+    self.size = pTamano
+
+class MensajeFalso:
+  __slots__ = ("id", "date", "message", "media", "file", "photo", "document", "fwd_from")
+
+  def __init__(self, pId: int, pFecha: datetime, pTexto: str, pArchivo: Optional[ArchivoFalso]):
+    self.id = pId
+    self.date = pFecha
+    self.message = pTexto
+    # La media hace de ubicación para iter_download, igual que pasar message.media a Telethon
+    self.media = pArchivo
+    self.file = pArchivo
+    # Toda la media falsa es un documento; no hay fotos ni vistas previas de enlaces
+    self.photo = None
+    self.document = pArchivo
+    self.fwd_from = None
+
+class ListaTotal(list):
+  total = 0
+
+class ClienteTelegramFalso:
+  """Imita la parte de TelegramClient que usan los scripts, con latencia y flood waits simulados."""
+
+  def __init__(self, pCfg: ConfigFalsa):
+    self.cfg = pCfg
+    self.flood_sleep_threshold = pCfg.flood_sleep_threshold
+    self.peticiones = 0
+    self.flood_waits = 0
+    self.segundos_flood = 0.0
+    self.bytes_descargados = 0
+    self.ids_borrados = 0
+    self.success = None
+
+    vAleatorio = random.Random(pCfg.semilla)
+    self._aleatorio = vAleatorio
+    self._mensajes: dict[int, MensajeFalso] = {}
+
+    vFechaBase = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    for vId in range(1, pCfg.mensajes + 1):
+      vFecha = vFechaBase + timedelta(minutes=vId)
+      vArchivo = None
+      vTexto = ""
+
+      if vAleatorio.random() < pCfg.media_ratio:
+        vTamano = vAleatorio.randint(pCfg.media_min_kb, pCfg.media_max_kb) * 1024
+        vNombre = f"archivo_{vId}.bin" if vAleatorio.random() < 0.5 else None
+        vArchivo = ArchivoFalso(vNombre, vTamano)
+
+      if vArchivo is None or vAleatorio.random() < pCfg.texto_ratio:
+        vTexto = f"Mensaje sintético número {vId}" if vAleatorio.random() > 0.1 else f"https://example.com/{vId}"
+
+      self._mensajes[vId] = MensajeFalso(vId, vFecha, vTexto, vArchivo)
+
+    # Ids en orden para paginar con bisect: recorrer el chat no reserva memoria proporcional a su tamaño
+    self._ids = list(self._mensajes)
+
+  async def _fSimularPeticion(self) -> None:
+    self.peticiones += 1
+
+    if self.cfg.latencia_ms:
+      await asyncio.sleep(self.cfg.latencia_ms / 1000)
+
+    if self.cfg.flood_prob and self._aleatorio.random() < self.cfg.flood_prob:
+      self.flood_waits += 1
+      # Igual que Telethon: las esperas cortas se duermen dentro del cliente y las largas se lanzan
+      if self.cfg.flood_segundos <= self.flood_sleep_threshold:
+        self.segundos_flood += self.cfg.flood_segundos
+        logging.getLogger("telethon.client.users").info(
+          "Sleeping%s for %ds (%s) on %s flood wait",
+          "",
+          self.cfg.flood_segundos,
+          timedelta(seconds=self.cfg.flood_segundos),
+          "ClienteTelegramFalso"
+        )
+        await asyncio.sleep(self.cfg.flood_segundos)
+      else:
+        raise FloodWaitError(request=None, capture=self.cfg.flood_segundos)
+
+  async def connect(self) -> None:
+    await self._fSimularPeticion()
+
+  async def disconnect(self) -> None:
+    return None
+
+  async def is_user_authorized(self) -> bool:
+    return True
+
+  def takeout(self, finalize=True, **pKwargs):
+    # La sesión takeout falsa es el propio cliente: mismas peticiones, mismos límites simulados
+    return self
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, pTipo, pValor, pTraza):
+    return None
+
+  def _fRecorrerIds(self, pDesdeId: int = 0, pHastaId: int = 0, pReverse: bool = False):
+    # Ids vivos estrictamente entre pDesdeId y pHastaId (0 = sin tope), del más antiguo al más reciente con reverse
+    vInicio = bisect.bisect_right(self._ids, pDesdeId)
+    vFin = bisect.bisect_left(self._ids, pHastaId) if pHastaId else len(self._ids)
+    vRango = range(vInicio, vFin) if pReverse else range(vFin - 1, vInicio - 1, -1)
+
+    for vIndice in vRango:
+      vId = self._ids[vIndice]
+      if vId in self._mensajes:
+        yield vId
+
+  async def get_messages(
+    self, pEntidad, limit=None, *, offset_date=None, offset_id=0, reverse=False, ids=None, **pKwargs
+  ):
+    await self._fSimularPeticion()
+    if ids is not None:
+      return self._mensajes.get(ids)
+
+    vResultado = ListaTotal()
+    vResultado.total = len(self._mensajes)
+    # Una sola página de GetHistory: con reverse, los más antiguos por encima de offset_id
+    if reverse:
+      vIds = self._fRecorrerIds(pDesdeId=offset_id, pReverse=True)
+    else:
+      vIds = self._fRecorrerIds(pHastaId=offset_id)
+    if offset_date is not None:
+      # Como el servidor: con offset_date solo los anteriores a esa fecha
+      vIds = (vId for vId in vIds if self._mensajes[vId].date < offset_date)
+    vResultado.extend(self._mensajes[vId] for vId, _ in zip(vIds, range(limit or 0)))
+    return vResultado
+
+  def _fCoincideBusqueda(self, pMessage: MensajeFalso, pBusqueda: Optional[str], pFiltro) -> bool:
+    # Solo se distingue "con media" de "sin media"; el tipo concreto no se simula
+    if pFiltro is not None and pFiltro.__class__.__name__ != "InputMessagesFilterEmpty" and not pMessage.media:
+      return False
+
+    return not pBusqueda or pBusqueda.lower() in pMessage.message.lower()
+
+  async def iter_messages(
+    self, pEntidad, limit=None, *, offset_date=None, offset_id=0, min_id=0, max_id=0, reverse=False,
+    wait_time=None, search=None, filter=None, **pKwargs
+  ):
+    # offset_id es un tope más por abajo o por arriba según el sentido del recorrido
+    vDesde = max(min_id, offset_id) if reverse else min_id
+    vHasta = min((vTope for vTope in (max_id, 0 if reverse else offset_id) if vTope), default=0)
+    vRestantes = limit
+
+    # Página a página, como el servidor: los mensajes borrados mientras se itera ya no aparecen en las siguientes
+    vIds = self._fRecorrerIds(vDesde, vHasta, reverse)
+    while vRestantes is None or vRestantes > 0:
+      aPagina = []
+      for vId in vIds:
+        vMessage = self._mensajes.get(vId)
+        if vMessage is None:
+          continue
+        if offset_date is not None and not (vMessage.date > offset_date if reverse else vMessage.date < offset_date):
+          continue
+        if not self._fCoincideBusqueda(vMessage, search, filter):
+          continue
+        aPagina.append(vMessage)
+        if len(aPagina) >= min(self.cfg.tamano_pagina, vRestantes or self.cfg.tamano_pagina):
+          break
+
+      if not aPagina:
+        return
+
+      await self._fSimularPeticion()
+      for vMessage in aPagina:
+        yield vMessage
+
+      if vRestantes is not None:
+        vRestantes -= len(aPagina)
+
+  async def iter_download(self, pMedia, *, offset=0, chunk_size=None, request_size=128 * 1024, **pKwargs):
+    vRestante = pMedia.size - offset
+    vTrozo = chunk_size or request_size
+
+    while vRestante > 0:
+      await self._fSimularPeticion()
+      vEntregar = min(vTrozo, vRestante)
+      if self.cfg.ancho_banda_mbps:
+        await asyncio.sleep(vEntregar / (self.cfg.ancho_banda_mbps * 1024 * 1024))
+      self.bytes_descargados += vEntregar
+      vRestante -= vEntregar
+      yield bytes(vEntregar)
+
+  async def download_media(self, pMessage, file=None, **pKwargs):
+    # Igual que Telethon acepta el Message o directamente su media
+    vMedia = pMessage.file if isinstance(pMessage, MensajeFalso) else pMessage
+    if not vMedia:
+      return None
+
+    await self._fSimularPeticion()
+
+    vRestante = vMedia.size
+    vTrozo = 512 * 1024
+    vCeros = bytes(vTrozo)
+
+    with open(file, "wb") as vArchivo:
+      while vRestante > 0:
+        vEscribir = min(vTrozo, vRestante)
+        if self.cfg.ancho_banda_mbps:
+          await asyncio.sleep(vEscribir / (self.cfg.ancho_banda_mbps * 1024 * 1024))
+        vArchivo.write(vCeros[:vEscribir])
+        vRestante -= vEscribir
+
+    self.bytes_descargados += vMedia.size
+    return str(file)
+
+  async def __call__(self, pRequest, ordered=False):
+    if isinstance(pRequest, SearchRequest):
+      await self._fSimularPeticion()
+      return SimpleNamespace(count=sum(
+        1 for vMessage in self._mensajes.values()
+        if vMessage.id > (pRequest.min_id or 0)
+        and (pRequest.min_date is None or vMessage.date >= pRequest.min_date)
+        and (pRequest.max_date is None or vMessage.date < pRequest.max_date)
+        and self._fCoincideBusqueda(vMessage, pRequest.q, pRequest.filter)
+      ), messages=[])
+
+    if not isinstance(pRequest, DeleteHistoryRequest):
+      raise NotImplementedError(f"ClienteTelegramFalso no simula {pRequest.__class__.__name__}")
+
+    await self._fSimularPeticion()
+
+    # Como el servidor: borra un tramo de los más recientes hasta max_id y avisa con offset si queda más
+    vIds = (
+      vId for vId in self._fRecorrerIds(pHastaId=pRequest.max_id + 1 if pRequest.max_id else 0)
+      if (pRequest.min_date is None or self._mensajes[vId].date >= pRequest.min_date)
+      and (pRequest.max_date is None or self._mensajes[vId].date <= pRequest.max_date)
+    )
+    aTramo = [vId for vId, _ in zip(vIds, range(self.cfg.tramo_historial))]
+    vQuedan = next(vIds, None) is not None
+
+    for vId in aTramo:
+      del self._mensajes[vId]
+
+    self.ids_borrados += len(aTramo)
+    return SimpleNamespace(pts=self.peticiones, pts_count=len(aTramo), offset=aTramo[-1] if vQuedan else 0)
+
+  async def delete_messages(self, pEntidad, message_ids, **pKwargs):
+    await self._fSimularPeticion()
+
+    if isinstance(message_ids, int):
+      message_ids = [message_ids]
+
+    vBorrados = 0
+    for vId in message_ids:
+      if self._mensajes.pop(vId, None) is not None:
+        vBorrados += 1
+
+    self.ids_borrados += vBorrados
+    return [SimpleNamespace(pts=self.peticiones, pts_count=vBorrados)]
+
+@dataclass
+class ResultadoBenchmark:
+  nombre: str
+  mensajes: int
+  segundos: float
+  mensajes_por_segundo: float
+  mb: float
+  mb_por_segundo: float
+  pico_memoria_mb: float
+  peticiones: int
+  flood_waits: int
+  segundos_flood: float
+
+def fParsearArgumentos() -> tuple[ConfigFalsa, argparse.Namespace]:
+  vParser = argparse.ArgumentParser(
+    description="Benchmark sin red de tsmdownloader.py y tsmeraser.py con un cliente de Telegram falso."
+  )
+  vParser.add_argument("--messages", type=int, default=2000, help="Cantidad de mensajes sintéticos (default: 2000)")
+  vParser.add_argument("--media-ratio", type=float, default=0.3, help="Fracción de mensajes con media (default: 0.3)")
+  vParser.add_argument("--text-ratio", type=float, default=0.5, help="Fracción de mensajes con media que además llevan texto (default: 0.5)")
+  vParser.add_argument("--media-min-kb", type=int, default=16, help="Tamaño mínimo de cada media en KB (default: 16)")
+  vParser.add_argument("--media-max-kb", type=int, default=512, help="Tamaño máximo de cada media en KB (default: 512)")
+  vParser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia simulada por petición en ms (default: 0)")
+  vParser.add_argument("--bandwidth-mbps", type=float, help="Ancho de banda simulado en MB/s (default: ilimitado)")
+  vParser.add_argument("--flood-prob", type=float, default=0.0, help="Probabilidad de FloodWait por petición (default: 0)")
+  vParser.add_argument("--flood-seconds", type=int, default=1, help="Segundos de cada FloodWait inyectado (default: 1)")
+  vParser.add_argument(
+    "--flood-sleep-threshold",
+    type=int,
+    default=60,
+    help="Esperas hasta este valor se duermen dentro del cliente, como en Telethon (default: 60)"
+  )
+  vParser.add_argument("--page-size", type=int, default=100, help="Mensajes por página de historial (default: 100)")
+  vParser.add_argument(
+    "--history-chunk",
+    type=int,
+    default=100,
+    help="Mensajes que borra cada llamada simulada a messages.DeleteHistory (default: 100)"
+  )
+  vParser.add_argument("--seed", type=int, default=1234, help="Semilla del generador (default: 1234)")
+  vParser.add_argument(
+    "--only",
+    choices=["download", "erase", "bulk"],
+    help="Ejecutar solo uno de los dos benchmarks"
+  )
+  vParser.add_argument(
+    "--memory-sweep",
+    metavar="N,N,...",
+    type=lambda pValor: sorted({int(vParte) for vParte in pValor.split(",") if vParte.strip()}),
+    help="Repetir los benchmarks con estos tamaños de chat y comparar el pico de memoria de cada uno"
+  )
+  vParser.add_argument("--json", dest="json_path", help="Guardar los resultados en este archivo JSON ('-' para stdout)")
+  vParser.add_argument("--show-progress", action="store_true", help="Mostrar las barras de progreso de los scripts")
+
+  vArgs = vParser.parse_args()
+
+  vCfgFalsa = ConfigFalsa(
+    mensajes=vArgs.messages,
+    media_ratio=vArgs.media_ratio,
+    texto_ratio=vArgs.text_ratio,
+    media_min_kb=vArgs.media_min_kb,
+    media_max_kb=max(vArgs.media_min_kb, vArgs.media_max_kb),
+    latencia_ms=vArgs.latency_ms,
+    ancho_banda_mbps=vArgs.bandwidth_mbps,
+    flood_prob=vArgs.flood_prob,
+    flood_segundos=vArgs.flood_seconds,
+    flood_sleep_threshold=vArgs.flood_sleep_threshold,
+    tamano_pagina=vArgs.page_size,
+    tramo_historial=max(1, vArgs.history_chunk),
+    semilla=vArgs.seed
+  )
+
+  return vCfgFalsa, vArgs
+
+async def fMedir(pNombre: str, pClient: ClienteTelegramFalso, pCorrutina) -> ResultadoBenchmark:
+  tracemalloc.start()
+  vInicio = time.perf_counter()
+
+  vMensajes = await pCorrutina
+
+  vSegundos = time.perf_counter() - vInicio
+  _, vPico = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  if isinstance(vMensajes, tuple):
+    vMensajes = vMensajes[0]
+
+  vMB = pClient.bytes_descargados / (1024 * 1024)
+
+  return ResultadoBenchmark(
+    nombre=pNombre,
+    mensajes=vMensajes,
+    segundos=round(vSegundos, 4),
+    mensajes_por_segundo=round(vMensajes / vSegundos, 2) if vSegundos else 0.0,
+    mb=round(vMB, 2),
+    mb_por_segundo=round(vMB / vSegundos, 2) if vSegundos else 0.0,
+    pico_memoria_mb=round(vPico / (1024 * 1024), 2),
+    peticiones=pClient.peticiones,
+    flood_waits=pClient.flood_waits,
+    segundos_flood=pClient.segundos_flood
+  )
+
+async def fBenchmarkDescarga(
+  pCfgFalsa: ConfigFalsa, pDirectorio: Path, pNombre: str = "fProcesarMensajes"
+) -> ResultadoBenchmark:
+  vClient = ClienteTelegramFalso(pCfgFalsa)
+  vCfg = mDownloader.Config(
+    api_id=0,
+    api_hash="",
+    phone=None,
+    output_dir=pDirectorio,
+    code=None,
+    password=None,
+    limit=None,
+    page_size=pCfgFalsa.tamano_pagina
+  )
+  vTotal = await mDownloader.fContarMensajes(vClient)
+  vClient.peticiones = 0
+  return await fMedir(pNombre, vClient, mDownloader.fProcesarMensajes(vClient, vCfg, vTotal))
+
+async def fBenchmarkBorrado(pCfgFalsa: ConfigFalsa) -> ResultadoBenchmark:
+  vClient = ClienteTelegramFalso(pCfgFalsa)
+  vCfg = mEraser.Config(
+    api_id=0,
+    api_hash="",
+    phone=None,
+    session="",
+    code=None,
+    password=None,
+    limit=None
+  )
+  vTotal = await mEraser.fContarMensajes(vClient)
+  vClient.peticiones = 0
+  return await fMedir("fBorrarMensajes", vClient, mEraser.fBorrarMensajes(vClient, vCfg, vTotal))
+
+async def fBenchmarkBorradoHistorial(pCfgFalsa: ConfigFalsa) -> ResultadoBenchmark:
+  vClient = ClienteTelegramFalso(pCfgFalsa)
+  vTotal = await mEraser.fContarMensajes(vClient)
+  aUltimo = await vClient.get_messages("me", limit=1)
+  vClient.peticiones = 0
+  return await fMedir("fBorrarHistorial", vClient, mEraser.fBorrarHistorial(vClient, vTotal, aUltimo[0].id))
+
+async def fBarridoMemoria(pCfgFalsa: ConfigFalsa, pArgs: argparse.Namespace) -> dict[str, dict[int, float]]:
+  dPicos: dict[str, dict[int, float]] = {}
+
+  # La primera pasada paga la importación perezosa de rich y telethon: se hace con el tamaño más pequeño y se descarta
+  for vIndice, vMensajes in enumerate([pArgs.memory_sweep[0]] + pArgs.memory_sweep):
+    vCfgFalsa = replace(pCfgFalsa, mensajes=vMensajes)
+    aResultados = []
+
+    if pArgs.only in (None, "download"):
+      with tempfile.TemporaryDirectory(prefix="tsmbench-") as vDirectorio:
+        aResultados.append(await fBenchmarkDescarga(vCfgFalsa, Path(vDirectorio)))
+        # La ejecución habitual es incremental: la segunda pasada sobre la misma carpeta carga el manifiesto y lo omite todo
+        aResultados.append(await fBenchmarkDescarga(vCfgFalsa, Path(vDirectorio), "fProcesarMensajes (repetida)"))
+
+    if pArgs.only in (None, "erase"):
+      aResultados.append(await fBenchmarkBorrado(vCfgFalsa))
+
+    if pArgs.only in (None, "bulk"):
+      aResultados.append(await fBenchmarkBorradoHistorial(vCfgFalsa))
+
+    if vIndice == 0:
+      continue
+
+    for vResultado in aResultados:
+      dPicos.setdefault(vResultado.nombre, {})[vMensajes] = vResultado.pico_memoria_mb
+
+  return dPicos
+
+def fMostrarBarridoMemoria(pdPicos: dict[str, dict[int, float]]) -> None:
+  vTabla = Table(title="Pico de memoria (MB) según el tamaño del chat")
+  vTabla.add_column("Función", no_wrap=True)
+  aTamanos = sorted({vMensajes for dPorTamano in pdPicos.values() for vMensajes in dPorTamano})
+  for vMensajes in aTamanos:
+    vTabla.add_column(f"{vMensajes} msgs", justify="right")
+  vTabla.add_column("Crecimiento", justify="right")
+
+  for vNombre, dPorTamano in pdPicos.items():
+    aPicos = [dPorTamano[vMensajes] for vMensajes in aTamanos]
+    # Con registros compactos y páginas acotadas el pico no debe seguir al tamaño del chat
+    vCrecimiento = aPicos[-1] / aPicos[0] if aPicos[0] else 0.0
+    vTabla.add_row(vNombre, *(f"{vPico:.2f}" for vPico in aPicos), f"x{vCrecimiento:.2f}")
+
+  console.print(vTabla)
+
+def fMostrarResultados(paResultados: list[ResultadoBenchmark]) -> None:
+  vTabla = Table(title="Resultados del benchmark")
+  vTabla.add_column("Función", no_wrap=True)
+  vTabla.add_column("Mensajes", justify="right")
+  vTabla.add_column("Segundos", justify="right")
+  vTabla.add_column("Mensajes/s", justify="right")
+  vTabla.add_column("MB/s", justify="right")
+  vTabla.add_column("Pico memoria (MB)", justify="right")
+  vTabla.add_column("Peticiones", justify="right")
+  vTabla.add_column("FloodWaits", justify="right")
+
+  for vResultado in paResultados:
+    vTabla.add_row(
+      vResultado.nombre,
+      str(vResultado.mensajes),
+      f"{vResultado.segundos:.2f}",
+      f"{vResultado.mensajes_por_segundo:.1f}",
+      f"{vResultado.mb_por_segundo:.2f}",
+      f"{vResultado.pico_memoria_mb:.2f}",
+      str(vResultado.peticiones),
+      str(vResultado.flood_waits)
+    )
+
+  console.print(vTabla)
+  console.print(f"[dim]Pico RSS del proceso: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB[/dim]")
+
+async def fEjecutar(pCfgFalsa: ConfigFalsa, pArgs: argparse.Namespace) -> int:
+  global console
+
+  if pArgs.json_path == "-":
+    # El JSON va a stdout limpio; la tabla se manda a stderr
+    console = Console(stderr=True)
+
+  if not pArgs.show_progress:
+    vConsolaSilenciosa = Console(quiet=True)
+    mDownloader.console = vConsolaSilenciosa
+    mEraser.console = vConsolaSilenciosa
+
+  if pArgs.memory_sweep:
+    dPicos = await fBarridoMemoria(pCfgFalsa, pArgs)
+    fMostrarBarridoMemoria(dPicos)
+
+    if pArgs.json_path:
+      vJSON = json.dumps(
+        {"config": asdict(pCfgFalsa), "barrido_memoria": {vNombre: dPorTamano for vNombre, dPorTamano in dPicos.items()}},
+        indent=2
+      )
+      if pArgs.json_path == "-":
+        sys.stdout.write(vJSON + "\n")
+      else:
+        Path(pArgs.json_path).write_text(vJSON + "\n", encoding="utf-8")
+
+    return 0
+
+  aResultados = []
+
+  if pArgs.only in (None, "download"):
+    with tempfile.TemporaryDirectory(prefix="tsmbench-") as vDirectorio:
+      aResultados.append(await fBenchmarkDescarga(pCfgFalsa, Path(vDirectorio)))
+
+  if pArgs.only in (None, "erase"):
+    aResultados.append(await fBenchmarkBorrado(pCfgFalsa))
+
+  if pArgs.only in (None, "bulk"):
+    aResultados.append(await fBenchmarkBorradoHistorial(pCfgFalsa))
+
+  fMostrarResultados(aResultados)
+
+  if pArgs.json_path:
+    vJSON = json.dumps(
+      {"config": asdict(pCfgFalsa), "resultados": [asdict(vResultado) for vResultado in aResultados]},
+      indent=2
+    )
+    if pArgs.json_path == "-":
+      sys.stdout.write(vJSON + "\n")
+    else:
+      Path(pArgs.json_path).write_text(vJSON + "\n", encoding="utf-8")
+
+  return 0
+
+def main() -> None:
+  vCfgFalsa, vArgs = fParsearArgumentos()
+
+  try:
+    raise SystemExit(asyncio.run(fEjecutar(vCfgFalsa, vArgs)))
+  except KeyboardInterrupt:
+    console.print("\n[bold red]Cancelado por el usuario.[/bold red]")
+    raise SystemExit(130)
+
+if __name__ == "__main__":
+  main()
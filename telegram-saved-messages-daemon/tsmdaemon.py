@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+
+# Pongo a disposición pública este script bajo el término de "software de dominio público".
+# Puedes hacer lo que quieras con él porque es libre de verdad; no libre con condiciones como las licencias GNU y otras patrañas similares.
+# Si se te llena la boca hablando de libertad entonces hazlo realmente libre.
+# No tienes que aceptar ningún tipo de términos de uso o licencia para utilizarlo o modificarlo porque va sin CopyLeft.
+
+# ----------
+# Script de NiPeGun para mantener abierta la conexión con Telegram y atender trabajos de tsmdownloader.py y tsmeraser.py
+#
+# Inicia sesión una vez y escucha en un socket Unix local. Mientras está en marcha, tsmdownloader.py y
+# tsmeraser.py le mandan su trabajo en lugar de conectar, iniciar sesión y desconectar en cada ejecución.
+# Necesita el repo clonado porque carga los scripts hermanos desde ../telegram-saved-messages-downloader
+# y ../telegram-saved-messages-eraser
+#
+# Ejecución:
+#   python3 ./tsmdaemon.py --api-id '12345678' --api-hash 'a1a2a3a4a5a6a7a8a9a0a1a2a3a4a5a6' --phone '+34666666666'
+# ----------
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Optional
+
+if TYPE_CHECKING:
+  from telethon import TelegramClient
+
+cDirectorioRepo = Path(__file__).resolve().parent.parent
+cRutaDownloader = cDirectorioRepo / "telegram-saved-messages-downloader" / "tsmdownloader.py"
+cRutaEraser = cDirectorioRepo / "telegram-saved-messages-eraser" / "tsmeraser.py"
+
+def fCargarScript(pNombre: str, pRuta: Path):
+  # Si ya está cargado (por ejemplo desde tsmbench.py) se usa ese módulo, para que el cambio de consola le afecte
+  if pNombre in sys.modules:
+    return sys.modules[pNombre]
+
+  vSpec = importlib.util.spec_from_file_location(pNombre, pRuta)
+  vModulo = importlib.util.module_from_spec(vSpec)
+  sys.modules[pNombre] = vModulo
+  vSpec.loader.exec_module(vModulo)
+  return vModulo
+
+mDownloader = fCargarScript("tsmdownloader", cRutaDownloader)
+mEraser = fCargarScript("tsmeraser", cRutaEraser)
+
+@dataclass
+class Config:
+  api_id: Optional[int]
+  api_hash: Optional[str]
+  phone: Optional[str]
+  code: Optional[str]
+  password: Optional[str]
+  socket: Path
+  sessions: list[str] = field(default_factory=lambda: ["tsm_session"])
+  status: bool = False
+  stop: bool = False
+  count: bool = False
+  chat: str = "me"
+
+def fParsearArgumentos() -> Config:
+  vParser = argparse.ArgumentParser(
+    description="Mantiene abierta la conexión con Telegram y atiende trabajos de tsmdownloader.py y tsmeraser.py."
+  )
+  vParser.add_argument("--api-id", type=int, help="Telegram API ID (obligatorio para arrancar el demonio)")
+  vParser.add_argument("--api-hash", help="Telegram API hash (obligatorio para arrancar el demonio)")
+  vParser.add_argument("--phone", help="Número de teléfono en formato internacional, ej: +34123456789")
+  vParser.add_argument(
+    "--session",
+    action="append",
+    dest="sessions",
+    help="Nombre/ruta base del archivo de sesión de Telethon; repetible para varias cuentas (default: tsm_session)"
+  )
+  vParser.add_argument("--code", help="Código OTP de Telegram")
+  vParser.add_argument("--password", help="Contraseña 2FA")
+  vParser.add_argument(
+    "--socket",
+    default=str(mDownloader.cRutaSocketDemonio),
+    help=f"Socket Unix en el que escuchar (default: {mDownloader.cRutaSocketDemonio}, o $TSM_DAEMON_SOCKET)"
+  )
+  vParser.add_argument("--status", action="store_true", help="Mostrar el estado del demonio en marcha y salir")
+  vParser.add_argument(
+    "--stop",
+    action="store_true",
+    help="Parar el demonio en marcha cuando termine su trabajo actual (los trabajos en cola no llegan a empezar)"
+  )
+  vParser.add_argument(
+    "--count",
+    action="store_true",
+    help="Pedir al demonio en marcha el número de mensajes de --chat en la primera --session"
+  )
+  vParser.add_argument("--chat", default="me", help="Chat para --count (default: me)")
+
+  vArgs = vParser.parse_args()
+  vEsCliente = vArgs.status or vArgs.stop or vArgs.count
+
+  if not vEsCliente and (vArgs.api_id is None or not vArgs.api_hash):
+    vParser.error("--api-id y --api-hash son obligatorios para arrancar el demonio")
+
+  return Config(
+    api_id=vArgs.api_id,
+    api_hash=vArgs.api_hash,
+    phone=vArgs.phone,
+    code=vArgs.code,
+    password=vArgs.password,
+    socket=Path(vArgs.socket).expanduser(),
+    sessions=list(dict.fromkeys(vArgs.sessions or ["tsm_session"])),
+    status=vArgs.status,
+    stop=vArgs.stop,
+    count=vArgs.count,
+    chat=vArgs.chat
+  )
+
+def fClaveSesion(pSesion: str, pCwd: str) -> str:
+  # Las sesiones se identifican por la ruta absoluta del archivo, resuelta desde el directorio del que las pide
+  vRuta = Path(pSesion).expanduser()
+  if not vRuta.is_absolute():
+    vRuta = Path(pCwd) / vRuta
+  return str(vRuta.resolve())
+
+def fEnviar(pWriter: asyncio.StreamWriter, pdMensaje: dict) -> None:
+  # Protocolo: un objeto JSON por línea en cada sentido
+  if not pWriter.is_closing():
+    pWriter.write((json.dumps(pdMensaje, ensure_ascii=False) + "\n").encode("utf-8"))
+
+class SalidaSocket(io.TextIOBase):
+  """Archivo de texto para la Console de rich que reenvía al cliente todo lo que se escribe."""
+
+  def __init__(self, pBucle: asyncio.AbstractEventLoop, pWriter: asyncio.StreamWriter):
+    self._bucle = pBucle
+    self._writer = pWriter
+
+  def write(self, pTexto: str) -> int:
+    # rich refresca la barra de progreso desde su propio hilo, así que el envío se delega al bucle de eventos
+    if pTexto:
+      self._bucle.call_soon_threadsafe(fEnviar, self._writer, {"tipo": "salida", "texto": pTexto})
+    return len(pTexto)
+
+  def writable(self) -> bool:
+    return True
+
+@dataclass
+class TrabajoDemonio:
+  peticion: dict
+  writer: asyncio.StreamWriter
+  futuro: asyncio.Future
+  tarea: Optional[asyncio.Task] = None
+  cancelado: bool = False
+
+class Demonio:
+  """Cola de trabajos servidos de uno en uno sobre las conexiones ya abiertas de cada sesión."""
+
+  def __init__(self, pdClientes: dict[str, TelegramClient]):
+    self.clientes = pdClientes
+    self.cola: asyncio.Queue = asyncio.Queue()
+    self.detener = asyncio.Event()
+    self.en_curso: Optional[TrabajoDemonio] = None
+    self.conexiones: set[asyncio.Task] = set()
+
+  def fParar(self, pCancelarEnCurso: bool = False) -> None:
+    """Deja de aceptar trabajos. El trabajo en curso termina, salvo con pCancelarEnCurso (Ctrl+C en el demonio)."""
+    self.detener.set()
+
+    # Los que esperaban en la cola no llegan a empezar: su cliente recibe un fin explícito en lugar de un corte
+    while not self.cola.empty():
+      vTrabajo, _ = self.cola.get_nowait()
+      if vTrabajo is None or vTrabajo.futuro.done():
+        continue
+      fEnviar(vTrabajo.writer, {"tipo": "salida", "texto": "El demonio se ha detenido antes de empezar este trabajo.\n"})
+      vTrabajo.futuro.set_result((1, {}))
+
+    if pCancelarEnCurso and self.en_curso is not None and self.en_curso.tarea is not None:
+      fEnviar(self.en_curso.writer, {"tipo": "salida", "texto": "Trabajo cancelado: el demonio se está deteniendo.\n"})
+      self.en_curso.tarea.cancel()
+
+    # El trabajador sale al llegar aquí, después del trabajo en curso si lo hay
+    self.cola.put_nowait((None, None))
+
+  def fPrepararTrabajo(self, pdPeticion: dict):
+    """Interpreta la petición y devuelve (corrutina que la ejecuta, None) o (None, motivo del rechazo)."""
+    vTipo = pdPeticion.get("tipo")
+    vCwd = pdPeticion.get("cwd") or os.getcwd()
+
+    if vTipo == "count":
+      vClient = self.clientes.get(fClaveSesion(pdPeticion.get("sesion") or "tsm_session", vCwd))
+      if vClient is None:
+        return None, "sesión no abierta en el demonio"
+
+      async def fContar():
+        return 0, {"total": await mDownloader.fContarMensajes(vClient, mDownloader.fParsearChat(pdPeticion.get("chat") or "me"))}
+      return fContar, None
+
+    if vTipo not in ("download", "erase"):
+      return None, f"tipo de trabajo desconocido: {vTipo}"
+
+    mScript = mDownloader if vTipo == "download" else mEraser
+
+    # Las rutas relativas de los argumentos son las del cliente; el análisis no espera nada, así que el chdir no se cruza
+    vCwdAnterior = os.getcwd()
+    vErrores = io.StringIO()
+    try:
+      os.chdir(vCwd)
+      with contextlib.redirect_stderr(vErrores):
+        vCfg = mScript.fParsearArgumentos(pdPeticion.get("argumentos") or [])
+    except SystemExit:
+      return None, vErrores.getvalue().strip() or "argumentos no válidos"
+    finally:
+      os.chdir(vCwdAnterior)
+
+    if vTipo == "download":
+      if vCfg.verify:
+        return None, "--verify no necesita conexión"
+
+      dClientes = {vSesion: self.clientes.get(fClaveSesion(vSesion, vCwd)) for vSesion in vCfg.sessions}
+      aFaltan = [vSesion for vSesion, vClient in dClientes.items() if vClient is None]
+      if aFaltan:
+        return None, f"sesión no abierta en el demonio: {', '.join(aFaltan)}"
+
+      return lambda: mDownloader.fEjecutar(vCfg, dClientes), None
+
+    vClient = self.clientes.get(fClaveSesion(vCfg.session, vCwd))
+    if vClient is None:
+      return None, f"sesión no abierta en el demonio: {vCfg.session}"
+
+    return lambda: mEraser.fEjecutar(vCfg, vClient), None
+
+  async def fCorrer(self, pTrabajo: TrabajoDemonio, pCorrutina) -> tuple[int, dict]:
+    from rich.console import Console
+
+    dPeticion = pTrabajo.peticion
+    vConsola = Console(
+      file=SalidaSocket(asyncio.get_running_loop(), pTrabajo.writer),
+      force_terminal=bool(dPeticion.get("tty")),
+      width=dPeticion.get("ancho") or 80
+    )
+
+    # Los trabajos van de uno en uno: mientras dura este, la consola y el directorio de trabajo son los del cliente
+    aConsolas = [mDownloader.console, mEraser.console]
+    vCwdAnterior = os.getcwd()
+    mDownloader.console = mEraser.console = vConsola
+    os.chdir(dPeticion.get("cwd") or vCwdAnterior)
+
+    try:
+      vResultado = await pCorrutina()
+    finally:
+      mDownloader.console, mEraser.console = aConsolas
+      os.chdir(vCwdAnterior)
+
+    if isinstance(vResultado, tuple):
+      return vResultado
+    return vResultado, {}
+
+  async def fTrabajador(self) -> None:
+    while True:
+      pTrabajo, pCorrutina = await self.cola.get()
+      if pTrabajo is None:
+        return
+      if pTrabajo.cancelado:
+        continue
+
+      self.en_curso = pTrabajo
+      pTrabajo.tarea = asyncio.create_task(self.fCorrer(pTrabajo, pCorrutina))
+      await asyncio.wait({pTrabajo.tarea})
+      self.en_curso = None
+
+      if pTrabajo.tarea.cancelled():
+        vCodigo, dExtra = 130, {}
+      elif pTrabajo.tarea.exception() is not None:
+        vError = pTrabajo.tarea.exception()
+        fEnviar(pTrabajo.writer, {"tipo": "salida", "texto": f"Error: {str(vError) or vError.__class__.__name__}\n"})
+        vCodigo, dExtra = 1, {}
+      else:
+        vCodigo, dExtra = pTrabajo.tarea.result()
+
+      fRegistrar(f"{pTrabajo.peticion.get('tipo')} desde {pTrabajo.peticion.get('cwd')} -> {vCodigo}")
+      if not pTrabajo.futuro.done():
+        pTrabajo.futuro.set_result((vCodigo, dExtra))
+
+  async def fAtender(self, pReader: asyncio.StreamReader, pWriter: asyncio.StreamWriter) -> None:
+    # Al parar se espera a estas conexiones para que cada cliente reciba su mensaje final
+    vConexion = asyncio.current_task()
+    self.conexiones.add(vConexion)
+
+    try:
+      vLinea = await pReader.readline()
+      try:
+        dPeticion = json.loads(vLinea)
+      except ValueError:
+        return
+
+      vTipo = dPeticion.get("tipo")
+
+      if vTipo == "ping":
+        fEnviar(pWriter, {
+          "tipo": "estado",
+          "pid": os.getpid(),
+          "sesiones": sorted(self.clientes),
+          "en_curso": self.en_curso.peticion.get("tipo") if self.en_curso else None,
+          "en_cola": self.cola.qsize()
+        })
+        return
+
+      if vTipo == "stop":
+        if not self.detener.is_set():
+          self.fParar()
+        fEnviar(pWriter, {"tipo": "fin", "codigo": 0})
+        return
+
+      if self.detener.is_set():
+        fEnviar(pWriter, {"tipo": "salida", "texto": "El demonio se está deteniendo y no acepta trabajos nuevos.\n"})
+        fEnviar(pWriter, {"tipo": "fin", "codigo": 1})
+        return
+
+      vCorrutina, vMotivo = self.fPrepararTrabajo(dPeticion)
+      if vCorrutina is None:
+        fEnviar(pWriter, {"tipo": "rechazado", "motivo": vMotivo})
+        return
+
+      vTrabajo = TrabajoDemonio(dPeticion, pWriter, asyncio.get_running_loop().create_future())
+      if self.en_curso is not None or not self.cola.empty():
+        fEnviar(pWriter, {"tipo": "salida", "texto": f"En cola detrás de {self.cola.qsize() + 1} trabajo(s)...\n"})
+      await self.cola.put((vTrabajo, vCorrutina))
+
+      # Si el cliente se va (Ctrl+C), su trabajo se cancela o se quita de la cola
+      vTareaCierre = asyncio.create_task(pReader.read())
+      await asyncio.wait({vTrabajo.futuro, vTareaCierre}, return_when=asyncio.FIRST_COMPLETED)
+
+      if not vTrabajo.futuro.done():
+        vTrabajo.cancelado = True
+        if vTrabajo.tarea is not None:
+          vTrabajo.tarea.cancel()
+          # Se espera a que el trabajador lo dé por terminado antes de soltar la conexión
+          await vTrabajo.futuro
+        return
+
+      vTareaCierre.cancel()
+      vCodigo, dExtra = vTrabajo.futuro.result()
+      fEnviar(pWriter, {"tipo": "fin", "codigo": vCodigo, **dExtra})
+    finally:
+      with contextlib.suppress(ConnectionError):
+        await pWriter.drain()
+      pWriter.close()
+      self.conexiones.discard(vConexion)
+
+def fRegistrar(pTexto: str) -> None:
+  print(f"[{datetime.now().strftime('%H:%M:%S')}] {pTexto}", flush=True)
+
+def fSocketEnUso(pRuta: Path) -> bool:
+  vSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    vSocket.connect(str(pRuta))
+    return True
+  except OSError:
+    return False
+  finally:
+    vSocket.close()
+
+async def fServir(pCfg: Config, pdClientes: Optional[dict[str, TelegramClient]] = None) -> int:
+  """Arranca el demonio. pdClientes permite pasar clientes ya conectados (por ejemplo uno falso en pruebas)."""
+  if pCfg.socket.exists():
+    if fSocketEnUso(pCfg.socket):
+      print(f"[ERROR] Ya hay un demonio escuchando en {pCfg.socket}")
+      return 1
+    # Socket huérfano de un demonio que no se cerró bien
+    pCfg.socket.unlink()
+
+  vCwd = os.getcwd()
+  dPropios: dict[str, TelegramClient] = {}
+  dClientes = {fClaveSesion(vSesion, vCwd): vClient for vSesion, vClient in (pdClientes or {}).items()}
+
+  try:
+    # El login puede pedir OTP por terminal, así que se hace aquí, una vez, antes de aceptar trabajos
+    for vSesion in pCfg.sessions:
+      vClave = fClaveSesion(vSesion, vCwd)
+      if vClave in dClientes:
+        continue
+
+      vClient = mDownloader.fCrearCliente(pCfg, vSesion)
+      dPropios[vClave] = dClientes[vClave] = vClient
+      await vClient.connect()
+      await mDownloader.fAsegurarLogin(vClient, pCfg)
+
+    vDemonio = Demonio(dClientes)
+    pCfg.socket.parent.mkdir(parents=True, exist_ok=True)
+    vServidor = await asyncio.start_unix_server(vDemonio.fAtender, path=str(pCfg.socket))
+    # Quien pueda abrir el socket puede usar la cuenta: solo el propio usuario
+    os.chmod(pCfg.socket, 0o600)
+
+    # SIGTERM para como --stop; Ctrl+C en el demonio cancela también el trabajo en curso
+    vBucle = asyncio.get_running_loop()
+    vBucle.add_signal_handler(signal.SIGTERM, vDemonio.fParar)
+    vBucle.add_signal_handler(signal.SIGINT, vDemonio.fParar, True)
+
+    vTareaTrabajador = asyncio.create_task(vDemonio.fTrabajador())
+    fRegistrar(f"Escuchando en {pCfg.socket} con {len(dClientes)} sesión(es)")
+
+    await vDemonio.detener.wait()
+
+    # Sin async with: desde Python 3.12 su salida espera a las conexiones abiertas y el orden dependería de la versión
+    vServidor.close()
+    fRegistrar("Parando: no se aceptan trabajos nuevos")
+    await vTareaTrabajador
+    await asyncio.gather(*vDemonio.conexiones, return_exceptions=True)
+    await vServidor.wait_closed()
+    fRegistrar("Demonio detenido")
+  finally:
+    with contextlib.suppress(FileNotFoundError):
+      pCfg.socket.unlink()
+    for vClient in dPropios.values():
+      await vClient.disconnect()
+
+  return 0
+
+def fPedir(pRuta: Path, pdPeticion: dict) -> Optional[dict]:
+  """Manda una petición al demonio, reenvía su salida y devuelve el mensaje final (None si no hay demonio)."""
+  vSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    vSocket.connect(str(pRuta))
+  except OSError:
+    vSocket.close()
+    return None
+
+  with vSocket, vSocket.makefile("rwb") as vCanal:
+    vCanal.write((json.dumps(pdPeticion) + "\n").encode("utf-8"))
+    vCanal.flush()
+
+    for vLinea in vCanal:
+      dMensaje = json.loads(vLinea)
+      if dMensaje["tipo"] == "salida":
+        sys.stdout.write(dMensaje["texto"])
+        sys.stdout.flush()
+      else:
+        return dMensaje
+
+  return None
+
+def main() -> None:
+  vCfg = fParsearArgumentos()
+
+  if vCfg.status or vCfg.stop or vCfg.count:
+    if vCfg.status:
+      dPeticion = {"tipo": "ping"}
+    elif vCfg.stop:
+      dPeticion = {"tipo": "stop"}
+    else:
+      dPeticion = {
+        "tipo": "count",
+        "sesion": vCfg.sessions[0],
+        "chat": vCfg.chat,
+        "cwd": os.getcwd(),
+        "ancho": shutil.get_terminal_size().columns
+      }
+
+    dRespuesta = fPedir(vCfg.socket, dPeticion)
+    if dRespuesta is None:
+      print(f"[ERROR] No hay ningún demonio escuchando en {vCfg.socket}")
+      raise SystemExit(1)
+
+    if dRespuesta["tipo"] == "estado":
+      print(f"PID: {dRespuesta['pid']}")
+      print(f"Sesiones: {', '.join(dRespuesta['sesiones'])}")
+      print(f"Trabajo en curso: {dRespuesta['en_curso'] or 'ninguno'}")
+      print(f"Trabajos en cola: {dRespuesta['en_cola']}")
+    elif dRespuesta["tipo"] == "rechazado":
+      print(f"[ERROR] {dRespuesta['motivo']}")
+      raise SystemExit(1)
+    elif "total" in dRespuesta:
+      print(dRespuesta["total"])
+
+    raise SystemExit(dRespuesta.get("codigo", 0))
+
+  mDownloader.fAsegurarDependencias()
+
+  try:
+    raise SystemExit(asyncio.run(fServir(vCfg)))
+  except KeyboardInterrupt:
+    raise SystemExit(130)
+
+if __name__ == "__main__":
+  main()
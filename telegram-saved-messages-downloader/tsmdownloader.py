@@ -15,6 +15,8 @@
 #   curl -sL https://raw.githubusercontent.com/nipegun/nipepruebas/refs/heads/main/telegram-saved-messages-downloader/tsmdownloader2.py | nano -
 # ----------
 
+from __future__ import annotations
+
 # ------ Inicio del bloque de instalación de dependencias de paquetes python ------
 
 # Definir los paquetes python que necesita este script siguiendo la convención de diccionario:
@@ -26,6 +28,7 @@ dPaquetesPython = {
 
 import getpass
 import importlib.util
+import json
 import os
 import re
 import shutil
@@ -33,12 +36,18 @@ import subprocess
 import sys
 
 from dataclasses import dataclass
+from dataclasses import field
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 from typing import Optional
+from typing import Union
 
 cNombreDelPaqueteApt = "python3-pip"
 
+# Sello que recuerda que las dependencias ya se comprobaron con este intérprete y estas versiones instaladas
+cRutaSelloDependencias = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "nipepruebas" / "tsm-dependencias.json"
+
 def fPaqueteAptEstaInstalado(pNombreDelPaqueteApt):
   vResultado = subprocess.run(
     ["dpkg", "-s", pNombreDelPaqueteApt],
@@ -49,41 +58,42 @@ def fPaqueteAptEstaInstalado(pNombreDelPaqueteApt):
 
 def fEjecutarComandoElevado(aComando):
   if os.geteuid() == 0:
-    subprocess.run(aComando, check=True)
+    subprocess.run(aComando, check=True, stdout=sys.stderr)
     return
 
   vRutaSudo = shutil.which("sudo")
   if vRutaSudo:
-    subprocess.run([vRutaSudo] + aComando, check=True)
+    subprocess.run([vRutaSudo] + aComando, check=True, stdout=sys.stderr)
     return
 
-  print("[ERROR] Se necesitan privilegios para instalar dependencias APT y no se encontró sudo.")
-  print("[INFO] Ejecuta el script como root o instala previamente python3-pip.")
+  print("[ERROR] Se necesitan privilegios para instalar dependencias APT y no se encontró sudo.", file=sys.stderr)
+  print("[INFO] Ejecuta el script como root o instala previamente python3-pip.", file=sys.stderr)
   sys.exit(1)
 
 def fInstalarPaqueteApt(pNombreDelPaqueteApt):
-  print(f"[*] Instalando paquete apt: {pNombreDelPaqueteApt}")
+  print(f"[*] Instalando paquete apt: {pNombreDelPaqueteApt}", file=sys.stderr)
   try:
     fEjecutarComandoElevado(["apt-get", "-y", "update"])
     fEjecutarComandoElevado(["apt-get", "-y", "install", pNombreDelPaqueteApt])
-    print(f"[OK] {pNombreDelPaqueteApt} instalado correctamente")
+    print(f"[OK] {pNombreDelPaqueteApt} instalado correctamente", file=sys.stderr)
   except subprocess.CalledProcessError as e:
-    print(f"[ERROR] Error instalando {pNombreDelPaqueteApt}: {e}")
+    print(f"[ERROR] Error instalando {pNombreDelPaqueteApt}: {e}", file=sys.stderr)
     sys.exit(1)
 
 def fModuloPythonEstaInstalado(pNombreDelModulo):
   return importlib.util.find_spec(pNombreDelModulo) is not None
 
 def fInstalarPaquetePython(pNombreDelPaquete):
-  print(f"[*] Instalando paquete Python: {pNombreDelPaquete}")
+  print(f"[*] Instalando paquete Python: {pNombreDelPaquete}", file=sys.stderr)
   try:
     subprocess.run(
       [sys.executable, "-m", "pip", "install", pNombreDelPaquete, "--break-system-packages"],
-      check=True
+      check=True,
+      stdout=sys.stderr
     )
-    print(f"[OK] {pNombreDelPaquete} instalado correctamente")
+    print(f"[OK] {pNombreDelPaquete} instalado correctamente", file=sys.stderr)
   except subprocess.CalledProcessError as e:
-    print(f"[ERROR] Error instalando {pNombreDelPaquete}: {e}")
+    print(f"[ERROR] Error instalando {pNombreDelPaquete}: {e}", file=sys.stderr)
     return False
 
   return True
@@ -93,75 +103,393 @@ def fComprobarEInstalarPaquetes(pdPaquetesPython):
 
   for vNombreModulo, vNombrePip in pdPaquetesPython.items():
     if fModuloPythonEstaInstalado(vNombreModulo):
-      print(f"[OK] {vNombrePip} ya está instalado")
+      print(f"[OK] {vNombrePip} ya está instalado", file=sys.stderr)
     else:
       if not fInstalarPaquetePython(vNombrePip):
         aErrores.append(vNombrePip)
 
   return aErrores
 
-print("=== Comprobando dependencias ===\n")
+def fHuellaDependencias(pdPaquetesPython):
+  # Ruta, mtime y tamaño del archivo de cada módulo: cambian en cuanto pip instala otra versión
+  importlib.invalidate_caches()
+  dHuella = {"python": sys.executable, "version": sys.version, "modulos": {}}
 
-if not fPaqueteAptEstaInstalado(cNombreDelPaqueteApt):
-  fInstalarPaqueteApt(cNombreDelPaqueteApt)
-else:
-  print(f"[OK] {cNombreDelPaqueteApt} ya está instalado")
+  for vNombreModulo in pdPaquetesPython:
+    vOrigen = importlib.util.find_spec(vNombreModulo).origin
+    vStat = os.stat(vOrigen)
+    dHuella["modulos"][vNombreModulo] = [vOrigen, vStat.st_mtime_ns, vStat.st_size]
 
-print()
+  return dHuella
 
-aErrores = fComprobarEInstalarPaquetes(dPaquetesPython)
+def fSelloDependenciasEsValido(pdPaquetesPython):
+  try:
+    dSello = json.loads(cRutaSelloDependencias.read_text(encoding="utf-8"))
+  except (OSError, ValueError):
+    return False
 
-print("\n=== Resumen ===")
-if aErrores:
-  print(f"[AVISO] Paquetes con errores: {', '.join(aErrores)}")
-  sys.exit(1)
-else:
-  print("[OK] Todas las dependencias instaladas correctamente")
+  if dSello.get("python") != sys.executable or dSello.get("version") != sys.version:
+    return False
+
+  dModulos = dSello.get("modulos", {})
+  if set(dModulos) != set(pdPaquetesPython):
+    return False
+
+  # En el camino rápido solo se hace stat de los archivos apuntados: ni dpkg ni find_spec
+  for vOrigen, vMtime, vTamano in dModulos.values():
+    try:
+      vStat = os.stat(vOrigen)
+    except (OSError, TypeError):
+      return False
+
+    if vStat.st_mtime_ns != vMtime or vStat.st_size != vTamano:
+      return False
+
+  return True
+
+def fGuardarSelloDependencias(pdPaquetesPython):
+  try:
+    cRutaSelloDependencias.parent.mkdir(parents=True, exist_ok=True)
+    cRutaSelloDependencias.write_text(json.dumps(fHuellaDependencias(pdPaquetesPython)), encoding="utf-8")
+  except (AttributeError, OSError, TypeError):
+    # Sin sello simplemente se vuelve a comprobar todo en la siguiente ejecución
+    pass
+
+def fAsegurarDependencias():
+  if fSelloDependenciasEsValido(dPaquetesPython):
+    return
+
+  # Todo a stderr, también lo de apt y pip: con --archive - la salida estándar es el propio archivo
+  print("=== Comprobando dependencias ===\n", file=sys.stderr)
+
+  if not fPaqueteAptEstaInstalado(cNombreDelPaqueteApt):
+    fInstalarPaqueteApt(cNombreDelPaqueteApt)
+  else:
+    print(f"[OK] {cNombreDelPaqueteApt} ya está instalado", file=sys.stderr)
+
+  print(file=sys.stderr)
+
+  aErrores = fComprobarEInstalarPaquetes(dPaquetesPython)
+
+  print("\n=== Resumen ===", file=sys.stderr)
+  if aErrores:
+    print(f"[AVISO] Paquetes con errores: {', '.join(aErrores)}", file=sys.stderr)
+    sys.exit(1)
+  else:
+    print("[OK] Todas las dependencias instaladas correctamente", file=sys.stderr)
+    fGuardarSelloDependencias(dPaquetesPython)
 
 # ------ Fin del bloque de instalación de dependencias ------
 # ------ A partir de aquí va el código real del script ------
 
 import argparse
 import asyncio
-
-from rich.console import Console
-from rich.panel import Panel
-from rich.progress import BarColumn
-from rich.progress import Progress
-from rich.progress import SpinnerColumn
-from rich.progress import TextColumn
-from rich.progress import TimeElapsedColumn
-from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError
-from telethon.tl.custom.message import Message
-
-console = Console()
+import bisect
+import contextlib
+import functools
+import hashlib
+import heapq
+import logging
+import socket
+import struct
+import tarfile
+import time
+import zipfile
+from array import array
+
+# rich y telethon se importan dentro de las funciones que los usan: --help no paga ninguno y --verify no carga telethon
+if TYPE_CHECKING:
+  from concurrent.futures import Executor
+
+  from rich.progress import Progress
+  from telethon import TelegramClient
+  from telethon.tl.custom.message import Message
+
+class ConsolaPerezosa:
+  """Crea la Console de rich la primera vez que se usa, para no importar rich al arrancar."""
+
+  def __init__(self):
+    self._consola = None
+    # Con --archive - la salida estándar es el archivo, así que los mensajes van a stderr
+    self.stderr = False
+
+  def fReal(self):
+    if self._consola is None:
+      from rich.console import Console
+      self._consola = Console(stderr=self.stderr)
+    return self._consola
+
+  def __getattr__(self, pNombre):
+    return getattr(self.fReal(), pNombre)
+
+def fConsolaRich():
+  # rich necesita una Console de verdad (por ejemplo para Progress), no el envoltorio perezoso
+  return console.fReal() if isinstance(console, ConsolaPerezosa) else console
+
+console = ConsolaPerezosa()
 
 cPatronSoloURL = re.compile(r"^https?://\S+$", re.IGNORECASE)
 cPatronCaracteresSeguros = re.compile(r"[^A-Za-z0-9._ -]+")
+cPatronIdNumerico = re.compile(r"^-?\d+$")
+cPatronPrefijoBase = re.compile(r"^y\d{4}m\d{2}d\d{2}h\d{2}m\d{2}s\d{2}(?:-id(\d+))?(?=-)")
+
+# Manifiesto de integridad que se mantiene en cada carpeta de salida: una línea JSON por mensaje, gana la última
+cNombreManifiesto = ".tsm-manifest.jsonl"
+cTamanoBloqueHash = 1024 * 1024
+# Enteros que se ordenan de una vez al indexar el manifiesto; el resto se mezcla bloque a bloque
+cTamanoBloqueOrden = 4096
+
+# Límites superiores (en ms) de las cubetas del histograma de latencias de cada etapa
+cCubetasLatenciaMs = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+# Logger en el que Telethon avisa de cada flood wait que se duerme internamente
+cLoggerFloodTelethon = "telethon.client.users"
+
+# Con --archive cada chat descarga hasta este tamaño de un miembro sin tener el archivo bloqueado para los demás
+cTamanoBufferArchivo = 8 * 1024 * 1024
+
+# Tamaño máximo de archivo que se declara al abrir la sesión takeout (el máximo de Telegram son 4000 MB)
+cTamanoMaximoTakeout = 4000 * 1024 * 1024
+
+# GetHistory devuelve como mucho 100 mensajes por petición; sin takeout se espera 1 s entre páginas, como Telethon
+cTamanoPaginaHistorial = 100
+cEsperaEntrePaginas = 1.0
+
+# Con --post-process, firmas de los formatos que pueden llegar como "Media" sin nombre: (cabecera, extensión)
+cFirmasArchivo = (
+  (b"\xff\xd8\xff", ".jpg"),
+  (b"\x89PNG\r\n\x1a\n", ".png"),
+  (b"GIF87a", ".gif"),
+  (b"GIF89a", ".gif"),
+  (b"%PDF-", ".pdf"),
+  (b"OggS", ".ogg"),
+  (b"fLaC", ".flac"),
+  (b"ID3", ".mp3"),
+  (b"II*\x00", ".tif"),
+  (b"MM\x00*", ".tif"),
+  (b"PK\x03\x04", ".zip"),
+  (b"7z\xbc\xaf\x27\x1c", ".7z"),
+  (b"Rar!\x1a\x07", ".rar"),
+  (b"\x1f\x8b", ".gz")
+)
+
+# Solo se cambia la extensión que no dice nada; la que viene del tipo MIME de Telegram se respeta
+cExtensionesGenericas = ("", ".bin", ".dat")
+
+# Etiquetas TIFF que se tocan al añadir la fecha: puntero al IFD Exif y DateTimeOriginal
+cEtiquetaPunteroExif = 0x8769
+cEtiquetaFechaOriginal = 0x9003
+
+# Con --purge los ids se borran de Telegram en lotes de este tamaño (el máximo que acepta una petición)
+cTamanoLoteBorrado = 100
+
+# Socket de tsmdaemon.py: si hay un demonio escuchando, el trabajo se le manda a él en lugar de conectar desde aquí
+cRutaSocketDemonio = Path(
+  os.environ.get("TSM_DAEMON_SOCKET")
+  or Path(os.environ.get("XDG_RUNTIME_DIR") or Path.home() / ".cache") / "nipepruebas" / "tsm-daemon.sock"
+)
 
 @dataclass
 class Config:
   api_id: int
   api_hash: str
   phone: Optional[str]
-  session: str
   output_dir: Path
   code: Optional[str]
   password: Optional[str]
   limit: Optional[int]
+  sessions: list[str] = field(default_factory=lambda: ["tsm_session"])
+  chats: list[str] = field(default_factory=lambda: ["me"])
+  jobs: int = 4
+  per_account: int = 2
+  stats_json: Optional[Path] = None
+  stats_interval: Optional[float] = None
+  takeout: bool = False
+  verify: bool = False
+  verify_hash: bool = False
+  verify_workers: Optional[int] = None
+  purge: bool = False
+  no_daemon: bool = False
+  archive: Optional[str] = None
+  archive_format: str = "tar"
+  page_size: int = cTamanoPaginaHistorial
+  page_delay: Optional[float] = None
+  prefetch_pages: int = 2
+  post_process: bool = False
+  post_workers: Optional[int] = None
+
+class EstadisticaEtapa:
+  __slots__ = ("cantidad", "segundos", "maximo", "bytes", "cubetas")
+
+  def __init__(self):
+    self.cantidad = 0
+    self.segundos = 0.0
+    self.maximo = 0.0
+    self.bytes = 0
+    self.cubetas = [0] * (len(cCubetasLatenciaMs) + 1)
+
+  def fRegistrar(self, pSegundos: float, pBytes: int = 0) -> None:
+    self.cantidad += 1
+    self.segundos += pSegundos
+    self.maximo = max(self.maximo, pSegundos)
+    self.bytes += pBytes
+    self.cubetas[bisect.bisect_left(cCubetasLatenciaMs, pSegundos * 1000)] += 1
+
+  def fPercentilMs(self, pFraccion: float) -> float:
+    # Aproximado: devuelve el límite superior de la cubeta donde cae el percentil
+    vObjetivo = pFraccion * self.cantidad
+    vAcumulado = 0
+
+    for vIndice, vCantidad in enumerate(self.cubetas):
+      vAcumulado += vCantidad
+      if vCantidad and vAcumulado >= vObjetivo:
+        if vIndice < len(cCubetasLatenciaMs):
+          return float(cCubetasLatenciaMs[vIndice])
+        break
+
+    return round(self.maximo * 1000, 3)
+
+  def fComoDiccionario(self) -> dict:
+    aEtiquetas = [f"<={vLimite}" for vLimite in cCubetasLatenciaMs] + [f">{cCubetasLatenciaMs[-1]}"]
+
+    return {
+      "cantidad": self.cantidad,
+      "segundos": round(self.segundos, 4),
+      "items_por_segundo": round(self.cantidad / self.segundos, 2) if self.segundos else None,
+      "bytes": self.bytes,
+      "bytes_por_segundo": round(self.bytes / self.segundos, 2) if self.segundos and self.bytes else None,
+      "latencia_ms": {
+        "media": round(self.segundos * 1000 / self.cantidad, 3) if self.cantidad else None,
+        "p50": self.fPercentilMs(0.50) if self.cantidad else None,
+        "p90": self.fPercentilMs(0.90) if self.cantidad else None,
+        "p99": self.fPercentilMs(0.99) if self.cantidad else None,
+        "max": round(self.maximo * 1000, 3)
+      },
+      "histograma_ms": {vEtiqueta: vCantidad for vEtiqueta, vCantidad in zip(aEtiquetas, self.cubetas) if vCantidad}
+    }
+
+class ManejadorFloodWait(logging.Handler):
+  def __init__(self, pMetricas: "Metricas"):
+    super().__init__(logging.INFO)
+    self.metricas = pMetricas
+
+  def emit(self, pRegistro: logging.LogRecord) -> None:
+    # Telethon registra ('Sleeping%s for %ds (%s) on %s flood wait', early, segundos, timedelta, petición)
+    if "flood wait" not in str(pRegistro.msg) or not isinstance(pRegistro.args, tuple) or len(pRegistro.args) < 2:
+      return
+
+    try:
+      self.metricas.fRegistrarFloodWait(float(pRegistro.args[1]))
+    except (TypeError, ValueError):
+      pass
+
+class Metricas:
+  """Tiempos, latencias y rendimiento de cada etapa de fProcesarMensajes."""
+
+  def __init__(self):
+    self.inicio = time.perf_counter()
+    self.inicio_iso = datetime.now().astimezone().isoformat(timespec="seconds")
+    self.etapas: dict[str, EstadisticaEtapa] = {}
+    self.mensajes = 0
+    self.borrados = 0
+    self.exif_escritos = 0
+    self.extensiones_corregidas = 0
+    self.flood_waits = 0
+    self.segundos_flood = 0.0
+
+  def fRegistrar(self, pEtapa: str, pSegundos: float, pBytes: int = 0) -> None:
+    vEstadistica = self.etapas.get(pEtapa)
+    if vEstadistica is None:
+      vEstadistica = self.etapas[pEtapa] = EstadisticaEtapa()
+    vEstadistica.fRegistrar(pSegundos, pBytes)
+
+  def fRegistrarFloodWait(self, pSegundos: float) -> None:
+    self.flood_waits += 1
+    self.segundos_flood += pSegundos
+
+  @contextlib.contextmanager
+  def fCapturarFloodWaits(self):
+    vLogger = logging.getLogger(cLoggerFloodTelethon)
+    vManejador = ManejadorFloodWait(self)
+    vNivelAnterior = vLogger.level
+
+    vLogger.addHandler(vManejador)
+    if vLogger.getEffectiveLevel() > logging.INFO:
+      vLogger.setLevel(logging.INFO)
+
+    try:
+      yield self
+    finally:
+      vLogger.removeHandler(vManejador)
+      vLogger.setLevel(vNivelAnterior)
+
+  def fComoDiccionario(self, pFinal: bool, pExtra: Optional[dict] = None) -> dict:
+    vSegundos = time.perf_counter() - self.inicio
+    vBytes = sum(vEstadistica.bytes for vEstadistica in self.etapas.values())
+
+    dInforme = {
+      "final": pFinal,
+      "inicio": self.inicio_iso,
+      "segundos": round(vSegundos, 3),
+      "mensajes": self.mensajes,
+      "mensajes_por_segundo": round(self.mensajes / vSegundos, 2) if vSegundos else None,
+      "borrados": self.borrados,
+      "exif_escritos": self.exif_escritos,
+      "extensiones_corregidas": self.extensiones_corregidas,
+      "bytes": vBytes,
+      "bytes_por_segundo": round(vBytes / vSegundos, 2) if vSegundos else None,
+      "flood_waits": {
+        "cantidad": self.flood_waits,
+        "segundos": round(self.segundos_flood, 3)
+      },
+      "etapas": {vNombre: vEstadistica.fComoDiccionario() for vNombre, vEstadistica in self.etapas.items()}
+    }
+
+    if pExtra:
+      dInforme.update(pExtra)
+
+    return dInforme
+
+  def fGuardarJSON(self, pRuta: Path, pFinal: bool, pExtra: Optional[dict] = None) -> None:
+    # Se escribe a un temporal y se renombra para que quien lo lea nunca vea un JSON a medias
+    pRuta.parent.mkdir(parents=True, exist_ok=True)
+    vRutaTemporal = pRuta.with_name(pRuta.name + ".tmp")
+    vRutaTemporal.write_text(
+      json.dumps(self.fComoDiccionario(pFinal, pExtra), indent=2, ensure_ascii=False) + "\n",
+      encoding="utf-8"
+    )
+    os.replace(vRutaTemporal, pRuta)
 
-def fParsearArgumentos() -> Config:
+def fParsearArgumentos(paArgumentos: Optional[list[str]] = None) -> Config:
   vParser = argparse.ArgumentParser(
-    description="Descarga todos los mensajes de 'Saved Messages' en archivos locales."
+    description="Descarga todos los mensajes de 'Saved Messages' (u otros chats) en archivos locales."
   )
-  vParser.add_argument("--api-id", type=int, required=True, help="Telegram API ID")
-  vParser.add_argument("--api-hash", required=True, help="Telegram API hash")
+  vParser.add_argument("--api-id", type=int, help="Telegram API ID (obligatorio salvo con --verify)")
+  vParser.add_argument("--api-hash", help="Telegram API hash (obligatorio salvo con --verify)")
   vParser.add_argument("--phone", help="Número de teléfono en formato internacional, ej: +34123456789")
   vParser.add_argument(
     "--session",
-    default="tsm_session",
-    help="Nombre/ruta base del archivo de sesión de Telethon (default: tsm_session)"
+    action="append",
+    dest="sessions",
+    help="Nombre/ruta base del archivo de sesión de Telethon; repetible para varias cuentas (default: tsm_session)"
+  )
+  vParser.add_argument(
+    "--chat",
+    action="append",
+    dest="chats",
+    help="Chat a exportar (me, @usuario, @canal, enlace o id numérico); repetible (default: me)"
+  )
+  vParser.add_argument(
+    "--jobs",
+    type=int,
+    default=4,
+    help="Cantidad máxima de chats exportándose a la vez entre todas las cuentas (default: 4)"
+  )
+  vParser.add_argument(
+    "--per-account",
+    type=int,
+    default=2,
+    help="Cantidad máxima de chats exportándose a la vez por cada cuenta (default: 2)"
   )
   vParser.add_argument(
     "--output-dir",
@@ -171,31 +499,185 @@ def fParsearArgumentos() -> Config:
   vParser.add_argument("--code", help="Código OTP de Telegram")
   vParser.add_argument("--password", help="Contraseña 2FA")
   vParser.add_argument("--limit", type=int, help="Límite de mensajes a descargar (opcional)")
+  vParser.add_argument(
+    "--takeout",
+    action="store_true",
+    help="Exportar a través de una sesión takeout de Telegram (límites más generosos); si no se concede se sigue en modo normal"
+  )
+  vParser.add_argument(
+    "--page-size",
+    type=int,
+    default=cTamanoPaginaHistorial,
+    help=f"Mensajes pedidos en cada página del historial, de 1 a {cTamanoPaginaHistorial} (default: {cTamanoPaginaHistorial})"
+  )
+  vParser.add_argument(
+    "--page-delay",
+    type=float,
+    metavar="SEGUNDOS",
+    help=f"Espera mínima entre peticiones de páginas del historial (default: {cEsperaEntrePaginas:g} s, 0 con --takeout)"
+  )
+  vParser.add_argument(
+    "--prefetch-pages",
+    type=int,
+    default=2,
+    help="Páginas del historial que se piden por adelantado mientras se procesa la actual; 0 para no adelantar (default: 2)"
+  )
+  vParser.add_argument(
+    "--archive",
+    metavar="DESTINO",
+    help="Escribir la exportación como un único archivo en flujo en DESTINO ('-' para la salida estándar, o una FIFO) en lugar de en --output-dir"
+  )
+  vParser.add_argument(
+    "--archive-format",
+    choices=["tar", "zip"],
+    default="tar",
+    help="Formato de --archive (default: tar)"
+  )
+  vParser.add_argument(
+    "--purge",
+    action="store_true",
+    help="Borrar de Telegram cada mensaje en cuanto está exportado y guardado en disco (exportar y vaciar en una sola pasada)"
+  )
+  vParser.add_argument(
+    "--post-process",
+    action="store_true",
+    help="Poner a cada media la fecha del mensaje (mtime/atime y EXIF DateTimeOriginal si falta) y corregir la extensión de las guardadas como 'Media', en procesos aparte"
+  )
+  vParser.add_argument(
+    "--post-workers",
+    type=int,
+    help="Procesos usados por --post-process (default: uno por CPU)"
+  )
+  vParser.add_argument(
+    "--verify",
+    action="store_true",
+    help="Comprobar sin conexión la exportación existente contra su manifiesto y marcar lo dañado para volver a descargarlo"
+  )
+  vParser.add_argument(
+    "--verify-hash",
+    action="store_true",
+    help="Con --verify, comprobar también el sha256 de cada archivo (más lento)"
+  )
+  vParser.add_argument(
+    "--verify-workers",
+    type=int,
+    help="Procesos usados por --verify (default: uno por CPU)"
+  )
+  vParser.add_argument(
+    "--stats-json",
+    help="Guardar al final un informe JSON con tiempos, latencias y rendimiento de cada etapa"
+  )
+  vParser.add_argument(
+    "--stats-interval",
+    type=float,
+    help="Reescribir el informe de --stats-json cada N segundos durante la exportación"
+  )
+  vParser.add_argument(
+    "--no-daemon",
+    action="store_true",
+    help="Conectar desde este proceso aunque haya un tsmdaemon.py en marcha"
+  )
+
+  vArgs = vParser.parse_args(paArgumentos)
+
+  if not vArgs.verify and (vArgs.api_id is None or not vArgs.api_hash):
+    vParser.error("--api-id y --api-hash son obligatorios salvo con --verify")
 
-  vArgs = vParser.parse_args()
+  if vArgs.archive and (vArgs.purge or vArgs.verify):
+    # En un flujo no hay forma de saber que lo escrito ha llegado a disco al otro lado
+    vParser.error("--archive no se puede combinar con --purge ni con --verify")
+
+  if vArgs.archive and vArgs.post_process:
+    # Dentro del archivo cada miembro ya lleva la fecha del mensaje y no se puede reescribir lo ya enviado
+    vParser.error("--archive no se puede combinar con --post-process")
 
   return Config(
     api_id=vArgs.api_id,
     api_hash=vArgs.api_hash,
     phone=vArgs.phone,
-    session=vArgs.session,
     output_dir=Path(vArgs.output_dir).expanduser().resolve(),
     code=vArgs.code,
     password=vArgs.password,
-    limit=vArgs.limit
+    limit=vArgs.limit,
+    sessions=list(dict.fromkeys(vArgs.sessions or ["tsm_session"])),
+    chats=list(dict.fromkeys(vArgs.chats or ["me"])),
+    jobs=max(1, vArgs.jobs),
+    per_account=max(1, vArgs.per_account),
+    stats_json=Path(vArgs.stats_json).expanduser().resolve() if vArgs.stats_json else None,
+    stats_interval=vArgs.stats_interval if vArgs.stats_interval and vArgs.stats_interval > 0 else None,
+    takeout=vArgs.takeout,
+    verify=vArgs.verify,
+    verify_hash=vArgs.verify_hash,
+    verify_workers=vArgs.verify_workers if vArgs.verify_workers and vArgs.verify_workers > 0 else None,
+    purge=vArgs.purge,
+    no_daemon=vArgs.no_daemon,
+    archive=vArgs.archive,
+    archive_format=vArgs.archive_format,
+    page_size=min(max(1, vArgs.page_size), cTamanoPaginaHistorial),
+    page_delay=max(0.0, vArgs.page_delay) if vArgs.page_delay is not None else None,
+    prefetch_pages=max(0, vArgs.prefetch_pages),
+    post_process=vArgs.post_process,
+    post_workers=vArgs.post_workers if vArgs.post_workers and vArgs.post_workers > 0 else None
   )
 
 def fSanitizarNombreDeArchivo(pValor: str, pFallback: str = "archivo") -> str:
   vLimpiado = cPatronCaracteresSeguros.sub("_", pValor).strip(" ._")
   return vLimpiado or pFallback
 
+def fParsearChat(pChat: str) -> Union[str, int]:
+  # Telethon solo interpreta los ids numéricos como tales si llegan como int
+  if cPatronIdNumerico.fullmatch(pChat):
+    return int(pChat)
+  return pChat
+
+def fDirectorioDeTrabajo(pCfg: Config, pSesion: str, pChat: str) -> Path:
+  # Con una sola cuenta y un solo chat se mantiene la carpeta de salida de siempre
+  if len(pCfg.sessions) == 1 and len(pCfg.chats) == 1:
+    return pCfg.output_dir
+
+  vCuenta = fSanitizarNombreDeArchivo(Path(pSesion).name, "sesion")
+  return pCfg.output_dir / vCuenta / fSanitizarNombreDeArchivo(pChat, "chat")
+
 def fGenerarPrefijoFecha(pFecha: datetime) -> str:
   return f"y{pFecha.year:04d}m{pFecha.month:02d}d{pFecha.day:02d}h{pFecha.hour:02d}m{pFecha.minute:02d}s{pFecha.second:02d}"
 
-def fGenerarPrefijoBase(pMessage: Message) -> str:
-  vTimestamp = pMessage.date.astimezone()
+@functools.lru_cache(maxsize=None)
+def fTipoMedia(pClase: type) -> str:
+  # Una sola cadena por clase de media, compartida por todos los registros
+  return pClase.__name__.removeprefix("MessageMedia").lower()
+
+class RegistroMensaje:
+  """Lo que la exportación necesita de un Message, sin el grafo de entidades y de cliente que cuelga de él.
+
+  Se extrae en cuanto llega cada página del historial para que los Message se liberen enseguida: así lo
+  que ocupa una exportación depende del tamaño de página y no de cuántos mensajes tenga el chat.
+  """
+
+  __slots__ = (
+    "id", "fecha", "tipo_media", "media", "descargable", "id_archivo", "nombre_archivo", "extension", "tamano", "texto"
+  )
+
+  def __init__(self, pMessage: Message):
+    vArchivo = pMessage.file if pMessage.media else None
+    self.id = pMessage.id
+    self.fecha = pMessage.date
+    # De la media se guarda la referencia porque es lo que Telethon necesita para descargarla. Sin el Message no
+    # puede renovar por su cuenta una referencia de archivo caducada: eso lo hace fVolverAPedirMensaje con el id
+    self.media = pMessage.media or None
+    self.tipo_media = fTipoMedia(type(pMessage.media)) if self.media else None
+    # La foto o el documento que hay de verdad detrás (también el de la vista previa de un enlace): es lo que se
+    # puede pedir por trozos, y de donde salen el tamaño y el nombre de message.file
+    self.descargable = (pMessage.photo or pMessage.document) if self.media else None
+    self.id_archivo = getattr(self.descargable, "id", None)
+    self.nombre_archivo = vArchivo.name if vArchivo else None
+    self.extension = vArchivo.ext if vArchivo else None
+    self.tamano = vArchivo.size if vArchivo else None
+    self.texto = (pMessage.message or "").strip()
+
+def fGenerarPrefijoBase(pRegistro: RegistroMensaje) -> str:
+  vTimestamp = pRegistro.fecha.astimezone()
   vPrefijoFecha = fGenerarPrefijoFecha(vTimestamp)
-  vMessageId = getattr(pMessage, "id", None)
+  vMessageId = getattr(pRegistro, "id", None)
 
   if vMessageId is None:
     return vPrefijoFecha
@@ -205,13 +687,495 @@ def fGenerarPrefijoBase(pMessage: Message) -> str:
 def fEsSoloURL(pTexto: str) -> bool:
   return bool(cPatronSoloURL.fullmatch(pTexto.strip()))
 
-def fEscribirArchivoDeTexto(pMessage: Message, pPrefijoBase: str, pDirectorioSalida: Path) -> Path:
-  vTexto = (pMessage.message or "").strip()
-  vExtension = "url" if fEsSoloURL(vTexto) else "txt"
-  vRutaArchivo = pDirectorioSalida / f"{pPrefijoBase}-Texto.{vExtension}"
-  vRutaArchivo.write_text(vTexto + "\n", encoding="utf-8")
+def fNombreMedia(pRegistro: RegistroMensaje) -> str:
+  if pRegistro.nombre_archivo:
+    return fSanitizarNombreDeArchivo(pRegistro.nombre_archivo, "Media")
+  return "Media"
+
+def fNombreArchivoDeTexto(pRegistro: RegistroMensaje, pPrefijoBase: str) -> str:
+  vExtension = "url" if fEsSoloURL(pRegistro.texto) else "txt"
+  return f"{pPrefijoBase}-Texto.{vExtension}"
+
+def fEscribirArchivoDeTexto(pRegistro: RegistroMensaje, pPrefijoBase: str, pDirectorioSalida: Path) -> Path:
+  vRutaArchivo = pDirectorioSalida / fNombreArchivoDeTexto(pRegistro, pPrefijoBase)
+  vRutaArchivo.write_text(pRegistro.texto + "\n", encoding="utf-8")
   return vRutaArchivo
 
+def fCalcularSHA256(pRuta: Path) -> str:
+  vHash = hashlib.sha256()
+  with open(pRuta, "rb") as vArchivo:
+    for vBloque in iter(lambda: vArchivo.read(cTamanoBloqueHash), b""):
+      vHash.update(vBloque)
+  return vHash.hexdigest()
+
+def fDescribirArchivo(pRuta: Path, pTipo: str) -> dict:
+  return {
+    "nombre": pRuta.name,
+    "tipo": pTipo,
+    "bytes": pRuta.stat().st_size,
+    "sha256": fCalcularSHA256(pRuta)
+  }
+
+def fCargarManifiesto(pDirectorio: Path) -> dict[int, dict]:
+  dManifiesto = {}
+  vRuta = pDirectorio / cNombreManifiesto
+
+  if not vRuta.exists():
+    return dManifiesto
+
+  with open(vRuta, "r", encoding="utf-8") as vArchivo:
+    for vLinea in vArchivo:
+      try:
+        dEntrada = json.loads(vLinea)
+      except json.JSONDecodeError:
+        # Una última línea a medias de una ejecución interrumpida no invalida el resto
+        continue
+      dManifiesto[dEntrada["id"]] = dEntrada
+
+  return dManifiesto
+
+def fCompactarManifiesto(pDirectorio: Path, pdManifiesto: dict[int, dict]) -> None:
+  vRuta = pDirectorio / cNombreManifiesto
+  vRutaTemporal = vRuta.with_name(vRuta.name + ".tmp")
+
+  with open(vRutaTemporal, "w", encoding="utf-8") as vArchivo:
+    for vId in sorted(pdManifiesto):
+      vArchivo.write(json.dumps(pdManifiesto[vId], ensure_ascii=False) + "\n")
+
+  os.replace(vRutaTemporal, vRuta)
+
+def fOrdenarSinRepetidos(paClaves: array) -> array:
+  # Ordena por bloques y los mezcla: nunca hay más de un bloque convertido en enteros de Python a la vez
+  aBloques = [
+    array("q", sorted(paClaves[vInicio:vInicio + cTamanoBloqueOrden]))
+    for vInicio in range(0, len(paClaves), cTamanoBloqueOrden)
+  ]
+  aOrdenadas = array("q")
+
+  for vClave in heapq.merge(*aBloques):
+    if not aOrdenadas or aOrdenadas[-1] != vClave:
+      aOrdenadas.append(vClave)
+
+  return aOrdenadas
+
+def fContieneOrdenado(paOrdenado: array, pValor: int) -> bool:
+  vIndice = bisect.bisect_left(paOrdenado, pValor)
+  return vIndice < len(paOrdenado) and paOrdenado[vIndice] == pValor
+
+class IndiceManifiesto:
+  # Solo lo que la comprobación de omitidos necesita: ids ordenados, dónde empieza su última línea y los pendientes.
+  # La entrada completa se relee del disco cuando hace falta, así la memoria no crece con el historial exportado.
+  __slots__ = ("ruta", "existia", "ids", "posiciones", "pendientes")
+
+  def __init__(self, pDirectorio: Path):
+    self.ruta = pDirectorio / cNombreManifiesto
+    self.existia = self.ruta.exists()
+    self.ids = array("q")
+    self.posiciones = array("q")
+    self.pendientes = set()
+
+    if not self.existia:
+      return
+
+    # Clave id << 32 | número de línea: al ordenar, la última línea de cada id queda la última de su grupo
+    aClaves = array("q")
+    aPosicionesLinea = array("q")
+    vPosicion = 0
+
+    with open(self.ruta, "rb") as vArchivo:
+      for vLinea in vArchivo:
+        vInicio = vPosicion
+        vPosicion += len(vLinea)
+        try:
+          dEntrada = json.loads(vLinea)
+        except json.JSONDecodeError:
+          # Una última línea a medias de una ejecución interrumpida no invalida el resto
+          continue
+
+        vId = dEntrada["id"]
+        aClaves.append(vId << 32 | len(aPosicionesLinea))
+        aPosicionesLinea.append(vInicio)
+        if dEntrada.get("pendiente"):
+          self.pendientes.add(vId)
+        else:
+          self.pendientes.discard(vId)
+
+    aClaves = fOrdenarSinRepetidos(aClaves)
+    for vIndice, vClave in enumerate(aClaves):
+      vId = vClave >> 32
+      vPosicionLinea = aPosicionesLinea[vClave & 0xFFFFFFFF]
+      if vIndice + 1 < len(aClaves) and aClaves[vIndice + 1] >> 32 == vId:
+        continue
+      self.ids.append(vId)
+      self.posiciones.append(vPosicionLinea)
+
+  def __contains__(self, pId: Optional[int]) -> bool:
+    return pId is not None and fContieneOrdenado(self.ids, pId)
+
+  def fEntrada(self, pId: int) -> Optional[dict]:
+    vIndice = bisect.bisect_left(self.ids, pId)
+    if vIndice == len(self.ids) or self.ids[vIndice] != pId:
+      return None
+
+    with open(self.ruta, "rb") as vArchivo:
+      vArchivo.seek(self.posiciones[vIndice])
+      return json.loads(vArchivo.readline())
+
+def fPrefijosExistentes(pDirectorio: Path) -> tuple[array, set[str]]:
+  # Un solo recorrido del directorio al empezar en lugar de un glob por cada mensaje.
+  # Los prefijos con id se guardan como enteros ordenados; los antiguos sin id son pocos y se quedan como texto.
+  aIds = array("q")
+  stPrefijosSinId = set()
+
+  with os.scandir(pDirectorio) as vEntradas:
+    for vEntrada in vEntradas:
+      vCoincidencia = cPatronPrefijoBase.match(vEntrada.name)
+      if not vCoincidencia:
+        continue
+      if vCoincidencia.group(1) is None:
+        stPrefijosSinId.add(vCoincidencia.group(0))
+      else:
+        aIds.append(int(vCoincidencia.group(1)))
+
+  return fOrdenarSinRepetidos(aIds), stPrefijosSinId
+
+def fMediaConPrefijoCompleta(pDirectorio: Path, pPrefijoBase: str, pTamano: int) -> bool:
+  # Un archivo cortado a mitad de descarga también lleva el prefijo: solo cuenta si mide lo que declara Telegram
+  for vRuta in pDirectorio.glob(f"{pPrefijoBase}-*"):
+    if not vRuta.name.startswith(f"{pPrefijoBase}-Texto.") and vRuta.stat().st_size == pTamano:
+      return True
+  return False
+
+def fArchivosDeEntradaPresentes(pDirectorio: Path, pdEntrada: dict) -> bool:
+  return all((pDirectorio / dArchivo["nombre"]).exists() for dArchivo in pdEntrada.get("archivos", []))
+
+def fBorrarArchivosDeEntrada(pDirectorio: Path, pdEntrada: dict) -> None:
+  for dArchivo in pdEntrada.get("archivos", []):
+    (pDirectorio / dArchivo["nombre"]).unlink(missing_ok=True)
+
+def fSincronizarArchivos(pDirectorio: Path, paNombres: list[str], pManifiesto) -> None:
+  # fsync de cada archivo, del directorio (para que sus entradas sobrevivan a un corte) y por último del manifiesto
+  for vNombre in paNombres:
+    vDescriptor = os.open(pDirectorio / vNombre, os.O_RDONLY)
+    try:
+      os.fsync(vDescriptor)
+    finally:
+      os.close(vDescriptor)
+
+  vDescriptor = os.open(pDirectorio, os.O_RDONLY)
+  try:
+    os.fsync(vDescriptor)
+  finally:
+    os.close(vDescriptor)
+
+  os.fsync(pManifiesto.fileno())
+
+def fDetectarExtension(pCabecera: bytes) -> Optional[str]:
+  if pCabecera[4:8] == b"ftyp":
+    vMarca = pCabecera[8:12]
+    if vMarca in (b"heic", b"heix", b"heim", b"heis", b"mif1"):
+      return ".heic"
+    if vMarca == b"qt  ":
+      return ".mov"
+    if vMarca.startswith(b"M4A"):
+      return ".m4a"
+    if vMarca.startswith(b"3g"):
+      return ".3gp"
+    return ".mp4"
+
+  if pCabecera[:4] == b"RIFF":
+    return {b"WEBP": ".webp", b"WAVE": ".wav", b"AVI ": ".avi"}.get(pCabecera[8:12])
+
+  if pCabecera[:4] == b"\x1a\x45\xdf\xa3":
+    return ".webm" if b"webm" in pCabecera else ".mkv"
+
+  for vFirma, vExtension in cFirmasArchivo:
+    if pCabecera.startswith(vFirma):
+      return vExtension
+
+  return None
+
+def fLeerIFD(pTiff: bytes, pOffset: int, pOrden: str) -> tuple[list[bytes], int]:
+  # Devuelve las entradas de 12 bytes tal cual y el offset del IFD siguiente
+  (vCantidad,) = struct.unpack_from(pOrden + "H", pTiff, pOffset)
+  if pOffset + 6 + 12 * vCantidad > len(pTiff):
+    raise ValueError("IFD truncado")
+  aEntradas = [pTiff[pOffset + 2 + 12 * vIndice:pOffset + 14 + 12 * vIndice] for vIndice in range(vCantidad)]
+  (vSiguiente,) = struct.unpack_from(pOrden + "I", pTiff, pOffset + 2 + 12 * vCantidad)
+  return aEntradas, vSiguiente
+
+def fAnadirIFD(pTiff: bytearray, paEntradas: list[bytes], pSiguiente: int, pOrden: str) -> int:
+  # Los IFD nuevos van al final: lo que ya había no se mueve y todos sus offsets siguen valiendo
+  if len(pTiff) % 2:
+    pTiff.append(0)
+  vOffset = len(pTiff)
+  aEntradas = sorted(paEntradas, key=lambda vEntrada: struct.unpack_from(pOrden + "H", vEntrada)[0])
+  pTiff += struct.pack(pOrden + "H", len(aEntradas)) + b"".join(aEntradas) + struct.pack(pOrden + "I", pSiguiente)
+  return vOffset
+
+def fTiffConFechaOriginal(pTiff: Optional[bytes], pFecha: str) -> Optional[bytes]:
+  """Devuelve el bloque TIFF del EXIF con DateTimeOriginal añadido, o None si ya la tenía."""
+  if pTiff is None:
+    pTiff = b"II*\x00" + struct.pack("<I", 8) + struct.pack("<HI", 0, 0)
+
+  vOrden = {b"II": "<", b"MM": ">"}.get(pTiff[:2])
+  if vOrden is None:
+    raise ValueError("cabecera TIFF desconocida")
+
+  (vOffsetIFD0,) = struct.unpack_from(vOrden + "I", pTiff, 4)
+  aEntradasIFD0, vSiguienteIFD0 = fLeerIFD(pTiff, vOffsetIFD0, vOrden)
+  dEtiquetasIFD0 = {struct.unpack_from(vOrden + "H", vEntrada)[0]: vIndice for vIndice, vEntrada in enumerate(aEntradasIFD0)}
+
+  aEntradasExif = []
+  if cEtiquetaPunteroExif in dEtiquetasIFD0:
+    (vOffsetExif,) = struct.unpack_from(vOrden + "I", aEntradasIFD0[dEtiquetasIFD0[cEtiquetaPunteroExif]], 8)
+    aEntradasExif, _ = fLeerIFD(pTiff, vOffsetExif, vOrden)
+    if any(struct.unpack_from(vOrden + "H", vEntrada)[0] == cEtiquetaFechaOriginal for vEntrada in aEntradasExif):
+      return None
+
+  vTiff = bytearray(pTiff)
+
+  # El valor ASCII (19 caracteres y el nulo) no cabe en la entrada, así que va detrás y la entrada lo apunta
+  if len(vTiff) % 2:
+    vTiff.append(0)
+  vOffsetFecha = len(vTiff)
+  vTiff += pFecha.encode("ascii") + b"\x00"
+
+  vEntradaFecha = struct.pack(vOrden + "HHII", cEtiquetaFechaOriginal, 2, 20, vOffsetFecha)
+  vOffsetExifNuevo = fAnadirIFD(vTiff, aEntradasExif + [vEntradaFecha], 0, vOrden)
+
+  # El IFD0 se copia al final con el puntero Exif nuevo y la cabecera pasa a apuntar a la copia
+  vEntradaPuntero = struct.pack(vOrden + "HHII", cEtiquetaPunteroExif, 4, 1, vOffsetExifNuevo)
+  aEntradasIFD0 = [vEntrada for vEntrada in aEntradasIFD0 if struct.unpack_from(vOrden + "H", vEntrada)[0] != cEtiquetaPunteroExif]
+  vOffsetIFD0Nuevo = fAnadirIFD(vTiff, aEntradasIFD0 + [vEntradaPuntero], vSiguienteIFD0, vOrden)
+  struct.pack_into(vOrden + "I", vTiff, 4, vOffsetIFD0Nuevo)
+
+  return bytes(vTiff)
+
+def fEscribirFechaExif(pRuta: Path, pFecha: str) -> bool:
+  """Añade DateTimeOriginal a un JPEG que no la tiene. Devuelve True si ha reescrito el archivo."""
+  vDatos = pRuta.read_bytes()
+  if vDatos[:2] != b"\xff\xd8":
+    return False
+
+  # Se recorren los segmentos de cabecera hasta el inicio de la imagen buscando el APP1 con el EXIF
+  vPosicion = 2
+  vInicioExif = vFinExif = None
+  vInsertar = 2
+  while vPosicion + 4 <= len(vDatos) and vDatos[vPosicion] == 0xFF:
+    vMarcador = vDatos[vPosicion + 1]
+    if vMarcador in (0xD9, 0xDA):
+      break
+    (vLongitud,) = struct.unpack_from(">H", vDatos, vPosicion + 2)
+    vFin = vPosicion + 2 + vLongitud
+    if vMarcador == 0xE1 and vDatos[vPosicion + 4:vPosicion + 10] == b"Exif\x00\x00":
+      vInicioExif, vFinExif = vPosicion, vFin
+      break
+    if vMarcador == 0xE0 and vPosicion == 2:
+      # Con JFIF su APP0 tiene que seguir siendo el primero; el EXIF nuevo va justo detrás
+      vInsertar = vFin
+    vPosicion = vFin
+
+  vTiff = None if vInicioExif is None else vDatos[vInicioExif + 10:vFinExif]
+  vTiffNuevo = fTiffConFechaOriginal(vTiff, pFecha)
+  if vTiffNuevo is None:
+    return False
+
+  vSegmento = b"Exif\x00\x00" + vTiffNuevo
+  if len(vSegmento) + 2 > 0xFFFF:
+    return False
+  vSegmento = b"\xff\xe1" + struct.pack(">H", len(vSegmento) + 2) + vSegmento
+
+  if vInicioExif is None:
+    vNuevos = vDatos[:vInsertar] + vSegmento + vDatos[vInsertar:]
+  else:
+    vNuevos = vDatos[:vInicioExif] + vSegmento + vDatos[vFinExif:]
+
+  # Se escribe aparte y se renombra encima: un corte a mitad nunca deja la foto a medias
+  vRutaTemporal = pRuta.with_name(pRuta.name + ".tmp")
+  vRutaTemporal.write_bytes(vNuevos)
+  os.replace(vRutaTemporal, pRuta)
+  return True
+
+def fPostProcesarMedia(pRuta: str, pTimestamp: float) -> dict:
+  # Se ejecuta en los procesos del pool de --post-process, lejos del bucle de eventos que descarga
+  vRuta = Path(pRuta)
+  dResultado = {"exif": False, "extension": None, "error": None, "archivo": None}
+
+  # Nunca lanza: cualquier fallo vuelve como "error" y, si el archivo se puede describir, se apunta igual
+  try:
+    with open(vRuta, "rb") as vArchivo:
+      vExtension = fDetectarExtension(vArchivo.read(64))
+
+    if vExtension and vRuta.stem.endswith("-Media") and vRuta.suffix.lower() in cExtensionesGenericas:
+      vRutaNueva = vRuta.with_name(vRuta.stem + vExtension)
+      if not vRutaNueva.exists():
+        os.rename(vRuta, vRutaNueva)
+        vRuta = vRutaNueva
+        dResultado["extension"] = vExtension
+
+    if vExtension == ".jpg":
+      # Hora local, como el prefijo del nombre: DateTimeOriginal no lleva zona horaria
+      dResultado["exif"] = fEscribirFechaExif(vRuta, datetime.fromtimestamp(pTimestamp).strftime("%Y:%m:%d %H:%M:%S"))
+  except Exception as e:
+    dResultado["error"] = str(e) or e.__class__.__name__
+
+  try:
+    # La fecha del archivo va al final porque reescribir el EXIF la habría cambiado
+    os.utime(vRuta, (pTimestamp, pTimestamp))
+    dResultado["archivo"] = fDescribirArchivo(vRuta, "media")
+  except Exception as e:
+    dResultado["error"] = dResultado["error"] or str(e) or e.__class__.__name__
+
+  return dResultado
+
+async def fTrozosDeBytes(pDatos: bytes):
+  yield pDatos
+
+async def fVolverAPedirMensaje(pClient: TelegramClient, pChat: Union[str, int], pRegistro: RegistroMensaje) -> Optional[Message]:
+  # La referencia de archivo caduca en descargas largas; el mensaje vuelto a pedir trae una nueva
+  vMessage = await pClient.get_messages(pChat, ids=pRegistro.id)
+  if vMessage is None or not vMessage.media:
+    return None
+
+  # Si la media se editó entretanto ya no es el mismo archivo y no se puede seguir donde se quedó
+  if RegistroMensaje(vMessage).id_archivo != pRegistro.id_archivo:
+    return None
+
+  return vMessage
+
+async def fTrozosDeMedia(pClient: TelegramClient, pChat: Union[str, int], pRegistro: RegistroMensaje):
+  """Trozos de la media de un registro. Si caduca la referencia se vuelve a pedir el mensaje y se sigue por donde iba."""
+  from telethon.errors import FilerefUpgradeNeededError
+  from telethon.errors import FileReferenceExpiredError
+
+  vDescargable = pRegistro.descargable
+  vRecibidos = 0
+  vRecibidosAlRenovar = None
+
+  while True:
+    try:
+      async for vTrozo in pClient.iter_download(vDescargable, offset=vRecibidos):
+        vRecibidos += len(vTrozo)
+        yield vTrozo
+      return
+    except (FileReferenceExpiredError, FilerefUpgradeNeededError):
+      # Una referencia recién renovada que caduca sin dar ni un byte no se arregla pidiendo otra
+      if vRecibidosAlRenovar == vRecibidos:
+        raise
+      vRecibidosAlRenovar = vRecibidos
+
+      vMessage = await fVolverAPedirMensaje(pClient, pChat, pRegistro)
+      if vMessage is None:
+        raise
+      vDescargable = vMessage.photo or vMessage.document
+
+class EscritorArchivo:
+  """tar o zip escrito en flujo sobre la salida estándar o una FIFO, sin archivos intermedios ni saltos atrás."""
+
+  def __init__(self, pDestino: str, pFormato: str):
+    self.destino = pDestino
+    self.formato = pFormato
+    self._salida = None
+    self._zip = None
+    self._bytes_tar = 0
+    # Varios chats pueden exportarse a la vez, pero cada miembro se escribe entero antes de empezar el siguiente.
+    # Solo la media de más de cTamanoBufferArchivo se descarga con el cerrojo cogido
+    self._cerrojo = asyncio.Lock()
+
+  async def fAbrir(self) -> None:
+    if self.destino == "-":
+      self._salida = sys.stdout.buffer
+    else:
+      # Abrir una FIFO bloquea hasta que aparece quien lee al otro lado
+      self._salida = await asyncio.to_thread(open, self.destino, "wb")
+
+    if self.formato == "zip":
+      # Sobre un flujo sin seek zipfile escribe los tamaños y el crc en un descriptor tras cada miembro
+      self._zip = zipfile.ZipFile(self._salida, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+  async def _fEscribirTar(self, pDatos: bytes) -> None:
+    await asyncio.to_thread(self._salida.write, pDatos)
+    self._bytes_tar += len(pDatos)
+
+  async def fEscribirMiembro(self, pNombre: str, pFecha: datetime, pTamano: int, pTrozos) -> int:
+    """Escribe un miembro a partir de un iterador asíncrono de trozos y devuelve los bytes que llegaron."""
+    vRecibidos = 0
+
+    # Lo que cabe en el búfer se descarga antes de coger el cerrojo, así un archivo pequeño de un chat no espera
+    # a que termine de llegar la media de otro. Si falla aquí todavía no se ha escrito nada en el archivo
+    aBuffer = []
+    vBufferados = 0
+    vAgotado = False
+    vIterador = pTrozos.__aiter__()
+    try:
+      while vBufferados < cTamanoBufferArchivo:
+        vTrozo = await vIterador.__anext__()
+        aBuffer.append(vTrozo)
+        vBufferados += len(vTrozo)
+    except StopAsyncIteration:
+      vAgotado = True
+
+    async def fTrozosCompletos():
+      for vTrozo in aBuffer:
+        yield vTrozo
+      if not vAgotado:
+        async for vTrozo in vIterador:
+          yield vTrozo
+
+    pTrozos = fTrozosCompletos()
+
+    async with self._cerrojo:
+      if self.formato == "zip":
+        vInfo = zipfile.ZipInfo(pNombre, date_time=pFecha.astimezone().timetuple()[:6])
+        vInfo.compress_type = zipfile.ZIP_STORED
+        vMiembro = self._zip.open(vInfo, "w", force_zip64=pTamano >= zipfile.ZIP64_LIMIT)
+        try:
+          async for vTrozo in pTrozos:
+            await asyncio.to_thread(vMiembro.write, vTrozo)
+            vRecibidos += len(vTrozo)
+        finally:
+          await asyncio.to_thread(vMiembro.close)
+        return vRecibidos
+
+      # En tar la cabecera lleva el tamaño, así que se usa el que declara Telegram y se ajusta lo que llegue
+      vInfo = tarfile.TarInfo(pNombre)
+      vInfo.size = pTamano
+      vInfo.mtime = int(pFecha.timestamp())
+      vInfo.mode = 0o644
+      await self._fEscribirTar(vInfo.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+
+      try:
+        async for vTrozo in pTrozos:
+          vTrozo = vTrozo[:pTamano - vRecibidos]
+          if vTrozo:
+            await self._fEscribirTar(vTrozo)
+            vRecibidos += len(vTrozo)
+      finally:
+        # Aunque la descarga falle el miembro se completa con ceros para que el tar siga siendo válido
+        vRelleno = pTamano - vRecibidos
+        vRelleno += -(pTamano) % tarfile.BLOCKSIZE
+        while vRelleno > 0:
+          vBloque = min(vRelleno, cTamanoBloqueHash)
+          await self._fEscribirTar(bytes(vBloque))
+          vRelleno -= vBloque
+
+    return vRecibidos
+
+  async def fCerrar(self) -> None:
+    async with self._cerrojo:
+      if self.formato == "zip":
+        await asyncio.to_thread(self._zip.close)
+      else:
+        # Dos bloques vacíos marcan el final y se completa el último registro, como hace tarfile
+        vFinal = 2 * tarfile.BLOCKSIZE
+        vFinal += -(self._bytes_tar + vFinal) % tarfile.RECORDSIZE
+        await self._fEscribirTar(bytes(vFinal))
+
+      await asyncio.to_thread(self._salida.flush)
+      if self._salida is not sys.stdout.buffer:
+        await asyncio.to_thread(self._salida.close)
+
 def fLeerDesdeTTY(pPrompt: str, pOculto: bool = False) -> str:
   try:
     with open("/dev/tty", "r", encoding="utf-8", errors="ignore") as vTTYIn:
@@ -252,7 +1216,14 @@ def fObtenerPassword2FA(pCfg: Config) -> str:
     password=True
   )
 
+def fCrearCliente(pCfg: Config, pSesion: str) -> TelegramClient:
+  from telethon import TelegramClient
+
+  return TelegramClient(pSesion, pCfg.api_id, pCfg.api_hash)
+
 async def fAsegurarLogin(pClient: TelegramClient, pCfg: Config) -> None:
+  from telethon.errors import SessionPasswordNeededError
+
   if await pClient.is_user_authorized():
     return
 
@@ -270,68 +1241,703 @@ async def fAsegurarLogin(pClient: TelegramClient, pCfg: Config) -> None:
     vPassword = fObtenerPassword2FA(pCfg)
     await pClient.sign_in(password=vPassword)
 
-async def fProcesarMensajes(pClient: TelegramClient, pCfg: Config, pTotalMensajes: int) -> tuple[int, int, int, int]:
-  pCfg.output_dir.mkdir(parents=True, exist_ok=True)
-
-  vContadorProcesados = 0
-  vCantidadMedia = 0
-  vCantidadTextos = 0
-  vCantidadOmitidos = 0
+def fCrearProgress() -> Progress:
+  from rich.progress import BarColumn
+  from rich.progress import Progress
+  from rich.progress import SpinnerColumn
+  from rich.progress import TextColumn
+  from rich.progress import TimeElapsedColumn
 
-  with Progress(
+  return Progress(
     SpinnerColumn(),
     TextColumn("[progress.description]{task.description}"),
     BarColumn(),
     TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
     TimeElapsedColumn(),
-    console=console
-  ) as vProgress:
-    vTask = vProgress.add_task("Descargando Saved Messages...", total=pTotalMensajes)
-
-    async for vMessage in pClient.iter_messages("me", reverse=True, limit=pCfg.limit):
-      vContadorProcesados += 1
-      vPrefijoBase = fGenerarPrefijoBase(vMessage)
-
-      vProgress.update(
-        vTask,
-        description=f"Descargando mensaje {vContadorProcesados} de {pTotalMensajes}",
-        completed=vContadorProcesados
-      )
-
-      if list(pCfg.output_dir.glob(f"{vPrefijoBase}-*")):
-        vCantidadOmitidos += 1
-        continue
-
-      if vMessage.media:
-        vNombreSugerido = "Media"
-
-        if vMessage.file and vMessage.file.name:
-          vNombreSugerido = fSanitizarNombreDeArchivo(vMessage.file.name, "Media")
-
-        vNombreDestino = f"{vPrefijoBase}-{vNombreSugerido}"
-        vRutaDestino = pCfg.output_dir / vNombreDestino
-        vRutaGuardada = await pClient.download_media(vMessage, file=vRutaDestino)
+    console=fConsolaRich()
+  )
 
-        if vRutaGuardada:
-          vCantidadMedia += 1
+class PaginadorHistorial:
+  """Recorre un chat del mensaje más antiguo al más reciente con las páginas siguientes ya pedidas.
+
+  Una tarea aparte pide cada página a partir del último id recibido, la reduce a RegistroMensaje y la deja en
+  una cola acotada, así que como mucho hay en memoria la página en curso, las adelantadas y la que está
+  llegando. Anclar por id y no por posición hace que los borrados de --purge detrás del cursor no desplacen
+  las páginas pendientes.
+  """
+
+  def __init__(
+    self,
+    pClient: TelegramClient,
+    pChat: Union[str, int],
+    pLimite: Optional[int] = None,
+    pTamanoPagina: int = cTamanoPaginaHistorial,
+    pEspera: float = 0.0,
+    pAdelantadas: int = 2,
+    pMetricas: Optional[Metricas] = None
+  ):
+    self.client = pClient
+    self.chat = pChat
+    self.limite = pLimite
+    self.tamano_pagina = pTamanoPagina
+    self.espera = pEspera
+    self.metricas = pMetricas or Metricas()
+    self.adelantadas = pAdelantadas
+    self._cola: asyncio.Queue = asyncio.Queue(maxsize=max(1, pAdelantadas))
+    self._tarea: Optional[asyncio.Task] = None
+
+  async def _fPedirPagina(self, pDesdeId: int, pLimite: int) -> list[RegistroMensaje]:
+    from telethon.errors import FloodWaitError
+
+    while True:
+      try:
+        aMensajes = await self.client.get_messages(self.chat, limit=pLimite, offset_id=pDesdeId, reverse=True)
+        return [RegistroMensaje(vMessage) for vMessage in aMensajes]
+      except FloodWaitError as e:
+        # Los flood waits cortos los duerme Telethon; los largos se esperan aquí en vez de abortar el chat
+        self.metricas.fRegistrarFloodWait(e.seconds)
+        await asyncio.sleep(e.seconds)
+
+  async def _fProductor(self) -> None:
+    vUltimoId = 0
+    vRestantes = self.limite
+    vUltimaPeticion = None
+
+    try:
+      while vRestantes is None or vRestantes > 0:
+        vLimite = self.tamano_pagina if vRestantes is None else min(self.tamano_pagina, vRestantes)
+
+        if vUltimaPeticion is not None and self.espera:
+          await asyncio.sleep(max(0.0, vUltimaPeticion + self.espera - time.monotonic()))
+        vUltimaPeticion = time.monotonic()
+
+        aPagina = await self._fPedirPagina(vUltimoId, vLimite)
+        if aPagina:
+          await self._cola.put(aPagina)
+          if not self.adelantadas:
+            # Sin adelanto la siguiente petición no sale hasta que se ha procesado esta página entera
+            await self._cola.join()
+          vUltimoId = aPagina[-1].id
+          if vRestantes is not None:
+            vRestantes -= len(aPagina)
+
+        # Una página corta es la última: no hace falta otra petición para descubrirlo
+        if len(aPagina) < vLimite:
+          break
+    except Exception as e:
+      await self._cola.put(e)
+      return
+
+    await self._cola.put(None)
+
+  async def __aenter__(self) -> "PaginadorHistorial":
+    self._tarea = asyncio.create_task(self._fProductor())
+    return self
+
+  async def __aexit__(self, pTipo, pValor, pTraza) -> None:
+    self._tarea.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+      await self._tarea
+
+  async def __aiter__(self):
+    while True:
+      vPagina = await self._cola.get()
+      if vPagina is None:
+        return
+      if isinstance(vPagina, Exception):
+        raise vPagina
+
+      for vRegistro in vPagina:
+        yield vRegistro
+      self._cola.task_done()
+
+async def fProcesarMensajes(
+  pClient: TelegramClient,
+  pCfg: Config,
+  pTotalMensajes: int,
+  pChat: Union[str, int] = "me",
+  pDirectorioSalida: Optional[Path] = None,
+  pProgress: Optional[Progress] = None,
+  pEtiqueta: str = "",
+  pMetricas: Optional[Metricas] = None,
+  pEsperaEntrePaginas: Optional[float] = None,
+  pClienteBorrado: Optional[TelegramClient] = None,
+  pPoolPostProceso: Optional[Executor] = None
+) -> tuple[int, int, int, int, int]:
+  from rich.markup import escape
+  from telethon.errors import FilerefUpgradeNeededError
+  from telethon.errors import FileReferenceExpiredError
+  from telethon.errors import FloodWaitError
+
+  vDirectorioSalida = pDirectorioSalida or pCfg.output_dir
+  vMetricas = pMetricas or Metricas()
+  vDirectorioSalida.mkdir(parents=True, exist_ok=True)
 
-      if (vMessage.message or "").strip():
-        fEscribirArchivoDeTexto(vMessage, vPrefijoBase, pCfg.output_dir)
-        vCantidadTextos += 1
+  vContadorProcesados = 0
+  vCantidadMedia = 0
+  vCantidadTextos = 0
+  vCantidadOmitidos = 0
+  vCantidadBorrados = 0
+
+  # Con --purge: ids ya exportados pendientes de fsync y lotes listos para borrar, con la cola acotada como freno
+  aIdsListos = []
+  aNombresListos = []
+  aErroresBorrado = []
+  vColaBorrado: asyncio.Queue = asyncio.Queue(maxsize=2)
+  vClienteBorrado = pClienteBorrado or pClient
+
+  # Con --post-process: medias en manos del pool, con un tope para que la descarga no se adelante sin límite
+  stTareasPostProceso: set[asyncio.Task] = set()
+  vSemaforoPostProceso = asyncio.Semaphore(2 * (pCfg.post_workers or os.cpu_count() or 1))
+
+  # El manifiesto manda; las carpetas exportadas antes de que existiera se siguen reconociendo por el prefijo
+  vIndiceManifiesto = IndiceManifiesto(vDirectorioSalida)
+  aIdsConPrefijo, stPrefijosSinId = fPrefijosExistentes(vDirectorioSalida)
+
+  # Cuando se exportan varios chats a la vez todos comparten la barra de progreso del llamador
+  vContextoProgress = fCrearProgress() if pProgress is None else contextlib.nullcontext(pProgress)
+  vPrefijoEtiqueta = escape(f"[{pEtiqueta}] ") if pEtiqueta else ""
+
+  with open(vDirectorioSalida / cNombreManifiesto, "a", encoding="utf-8") as vManifiesto, vContextoProgress as vProgress:
+    vTask = vProgress.add_task(f"{vPrefijoEtiqueta}Descargando Saved Messages...", total=pTotalMensajes)
+
+    async def fTrabajadorBorrado() -> None:
+      nonlocal vCantidadBorrados
+
+      while True:
+        aIds = await vColaBorrado.get()
+        if aIds is None:
+          return
+
+        # Tras un fallo se sigue vaciando la cola para que la descarga no se quede bloqueada, pero ya sin borrar
+        if aErroresBorrado:
+          continue
+
+        vInicio = time.perf_counter()
+        try:
+          while True:
+            try:
+              await vClienteBorrado.delete_messages(pChat, aIds)
+              break
+            except FloodWaitError as e:
+              vMetricas.fRegistrarFloodWait(e.seconds)
+              await asyncio.sleep(e.seconds)
+        except Exception as e:
+          aErroresBorrado.append(e)
+          continue
+
+        vMetricas.fRegistrar("borrado", time.perf_counter() - vInicio)
+        # También en las métricas: si la exportación falla después, el resumen sigue sabiendo cuánto se borró
+        vMetricas.borrados += len(aIds)
+        vCantidadBorrados += len(aIds)
+
+    async def fEntregarListos() -> None:
+      # Un id solo pasa al borrado cuando sus archivos y su línea del manifiesto ya están en disco de verdad
+      if not aIdsListos:
+        return
+
+      # Se toma lo anotado hasta ahora: el post-proceso puede anotar más mientras dura el fsync
+      aIds = aIdsListos[:]
+      aNombres = aNombresListos[:]
+      del aIdsListos[:len(aIds)]
+      del aNombresListos[:len(aNombres)]
+
+      vInicio = time.perf_counter()
+      await asyncio.to_thread(fSincronizarArchivos, vDirectorioSalida, aNombres, vManifiesto)
+      vMetricas.fRegistrar("fsync", time.perf_counter() - vInicio)
+
+      if aErroresBorrado:
+        raise aErroresBorrado[0]
+
+      await vColaBorrado.put(aIds)
+
+    def fAnotarParaBorrar(pIdMensaje: int, paArchivos: list[dict]) -> None:
+      if pCfg.purge:
+        aIdsListos.append(pIdMensaje)
+        aNombresListos.extend(dArchivo["nombre"] for dArchivo in paArchivos)
+
+    def fEscribirEntrada(
+      pIdMensaje: int, pPrefijoBase: str, paArchivos: list[dict], pTamanoTelegram: Optional[int], pExif: bool = False
+    ) -> None:
+      dEntrada = {"id": pIdMensaje, "prefijo": pPrefijoBase, "archivos": paArchivos, "telegram_bytes": pTamanoTelegram}
+      if pExif:
+        dEntrada["exif"] = True
+      vManifiesto.write(json.dumps(dEntrada, ensure_ascii=False) + "\n")
+      vManifiesto.flush()
+      fAnotarParaBorrar(pIdMensaje, paArchivos)
+
+    async def fPostProcesar(
+      pIdMensaje: int, pPrefijoBase: str, pRutaMedia: Path, pFecha: datetime, paTextos: list[dict], pTamanoTelegram: Optional[int]
+    ) -> None:
+      # La entrada del manifiesto (y con ella el borrado de --purge) espera a que la media tenga su nombre y bytes finales
+      try:
+        vInicio = time.perf_counter()
+        try:
+          dResultado = await asyncio.get_running_loop().run_in_executor(
+            pPoolPostProceso, fPostProcesarMedia, str(pRutaMedia), pFecha.timestamp()
+          )
+        except Exception as e:
+          # Si el pool falla la media sigue intacta en disco: se apunta tal cual y solo se pierde el post-proceso
+          dResultado = {"exif": False, "extension": None, "error": str(e) or e.__class__.__name__, "archivo": None}
+          with contextlib.suppress(OSError):
+            dResultado["archivo"] = await asyncio.to_thread(fDescribirArchivo, pRutaMedia, "media")
+
+        if dResultado["error"]:
+          console.print(
+            f"[yellow]{vPrefijoEtiqueta}No se pudo post-procesar el mensaje {pIdMensaje}: {escape(dResultado['error'])}[/yellow]"
+          )
+        vMetricas.exif_escritos += dResultado["exif"]
+        vMetricas.extensiones_corregidas += dResultado["extension"] is not None
+
+        if dResultado["archivo"] is None:
+          # Sin la media en disco no hay nada que apuntar: la siguiente ejecución lo vuelve a descargar
+          console.print(
+            f"[yellow]{vPrefijoEtiqueta}La media del mensaje {pIdMensaje} no está en disco; "
+            f"se volverá a descargar en la próxima ejecución.[/yellow]"
+          )
+          return
+
+        vMetricas.fRegistrar("postproceso", time.perf_counter() - vInicio, dResultado["archivo"]["bytes"])
+        fEscribirEntrada(pIdMensaje, pPrefijoBase, [dResultado["archivo"], *paTextos], pTamanoTelegram, dResultado["exif"])
+      finally:
+        vSemaforoPostProceso.release()
+
+    def fAlTerminarPostProceso(pTarea: asyncio.Task) -> None:
+      stTareasPostProceso.discard(pTarea)
+
+      # Un fallo inesperado al apuntar la entrada no para al resto, pero tampoco se pierde en silencio
+      if not pTarea.cancelled() and pTarea.exception() is not None:
+        vError = pTarea.exception()
+        console.print(
+          f"[bold red]{vPrefijoEtiqueta}Error post-procesando un mensaje:[/bold red] "
+          f"{escape(str(vError) or vError.__class__.__name__)}"
+        )
+
+    async def fEsperarPostProceso() -> None:
+      if stTareasPostProceso:
+        await asyncio.gather(*stTareasPostProceso, return_exceptions=True)
+
+    vTareaBorrado = asyncio.create_task(fTrabajadorBorrado()) if pCfg.purge else None
+
+    try:
+      # El tiempo entre el final de un mensaje y la llegada del siguiente es lo que cuesta paginar el historial
+      vMarca = time.perf_counter()
+
+      async with PaginadorHistorial(
+        pClient, pChat, pCfg.limit, pCfg.page_size, pEsperaEntrePaginas or 0.0, pCfg.prefetch_pages, vMetricas
+      ) as vPaginador:
+        async for vRegistro in vPaginador:
+          vAhora = time.perf_counter()
+          vMetricas.fRegistrar("historial", vAhora - vMarca)
+          vMetricas.mensajes += 1
+          vContadorProcesados += 1
+          vPrefijoBase = fGenerarPrefijoBase(vRegistro)
+
+          vDescripcion = f"{vPrefijoEtiqueta}Descargando mensaje {vContadorProcesados} de {pTotalMensajes}"
+          if pCfg.purge:
+            vDescripcion += f" · {vCantidadBorrados} borrados"
+          vProgress.update(vTask, description=vDescripcion, completed=vContadorProcesados)
+
+          if len(aIdsListos) >= cTamanoLoteBorrado:
+            await fEntregarListos()
+
+          vInicio = time.perf_counter()
+          dEntrada = None
+          if vRegistro.id in vIndiceManifiesto:
+            vYaExiste = vRegistro.id not in vIndiceManifiesto.pendientes
+            # La entrada completa solo se lee del disco cuando se van a tocar sus archivos
+            if not vYaExiste or pCfg.purge:
+              dEntrada = vIndiceManifiesto.fEntrada(vRegistro.id)
+            if vYaExiste and pCfg.purge and not fArchivosDeEntradaPresentes(vDirectorioSalida, dEntrada):
+              # Borrados a mano después de exportarlos: se tratan como pendientes y se descargan otra vez antes de borrar
+              vYaExiste = False
+          else:
+            # Sin nada que descargar, volver a exportarlo cuesta lo mismo que comprobarlo y deja su línea en el manifiesto
+            if vRegistro.id is None:
+              vTienePrefijo = vPrefijoBase in stPrefijosSinId
+            else:
+              vTienePrefijo = fContieneOrdenado(aIdsConPrefijo, vRegistro.id)
+            vYaExiste = vTienePrefijo and vRegistro.descargable is not None
+            if vYaExiste and vRegistro.tamano is not None:
+              vYaExiste = fMediaConPrefijoCompleta(vDirectorioSalida, vPrefijoBase, vRegistro.tamano)
+            elif vYaExiste:
+              # Sin tamaño con el que comparar, el prefijo solo vale en carpetas anteriores al manifiesto
+              vYaExiste = not vIndiceManifiesto.existia
+          vMetricas.fRegistrar("comprobacion_omitidos", time.perf_counter() - vInicio)
+
+          if vYaExiste:
+            vCantidadOmitidos += 1
+            # Exportado en otra ejecución: con manifiesto se sabe qué archivos son y se puede borrar igual
+            if dEntrada is not None:
+              fAnotarParaBorrar(vRegistro.id, dEntrada.get("archivos", []))
+            vMarca = time.perf_counter()
+            continue
+
+          if dEntrada is not None:
+            # Marcado por --verify o con archivos que faltan: se quitan los restos antes de volver a descargarlo
+            fBorrarArchivosDeEntrada(vDirectorioSalida, dEntrada)
+
+          aArchivos = []
+          vCompleto = True
+          vTamanoTelegram = None
+          vRutaPostProceso = None
+
+          if vRegistro.media is not None:
+            vNombreDestino = f"{vPrefijoBase}-{fNombreMedia(vRegistro)}"
+            vRutaDestino = vDirectorioSalida / vNombreDestino
+            vTamanoTelegram = vRegistro.tamano
+            vInicio = time.perf_counter()
+            try:
+              vRutaGuardada = await pClient.download_media(vRegistro.media, file=vRutaDestino)
+            except (FileReferenceExpiredError, FilerefUpgradeNeededError):
+              # Con el Message en la mano Telethon sabe renovar la referencia por su cuenta si vuelve a caducar
+              vMessage = await fVolverAPedirMensaje(pClient, pChat, vRegistro)
+              if vMessage is None:
+                raise
+              vRutaGuardada = await pClient.download_media(vMessage, file=vRutaDestino)
+
+            if vRutaGuardada:
+              vCantidadMedia += 1
+              vMetricas.fRegistrar("descarga_media", time.perf_counter() - vInicio, os.path.getsize(vRutaGuardada))
+
+              if pPoolPostProceso is not None:
+                # El hash lo calcula el pool al terminar, porque el post-proceso puede cambiar los bytes y el nombre
+                vRutaPostProceso = Path(vRutaGuardada)
+              else:
+                # El hash lee el archivo entero de disco, así que se hace fuera del bucle de eventos
+                vInicio = time.perf_counter()
+                aArchivos.append(await asyncio.to_thread(fDescribirArchivo, Path(vRutaGuardada), "media"))
+                vMetricas.fRegistrar("hash_media", time.perf_counter() - vInicio, aArchivos[-1]["bytes"])
+            elif vRegistro.descargable is not None:
+              vCompleto = False
+
+          if vRegistro.texto:
+            vInicio = time.perf_counter()
+            vRutaTexto = fEscribirArchivoDeTexto(vRegistro, vPrefijoBase, vDirectorioSalida)
+            if pPoolPostProceso is not None:
+              os.utime(vRutaTexto, (vRegistro.fecha.timestamp(), vRegistro.fecha.timestamp()))
+            vMetricas.fRegistrar("escritura_texto", time.perf_counter() - vInicio, vRutaTexto.stat().st_size)
+            aArchivos.append(fDescribirArchivo(vRutaTexto, "texto"))
+            vCantidadTextos += 1
+
+          # Si la descarga falla no se apunta en el manifiesto, para que la siguiente ejecución lo reintente. Una
+          # media sin archivo (ubicación, encuesta, enlace sin vista previa) sí se apunta: no hay nada más que bajar
+          if vCompleto and vRutaPostProceso is not None:
+            await vSemaforoPostProceso.acquire()
+            vTareaPostProceso = asyncio.create_task(fPostProcesar(
+              vRegistro.id, vPrefijoBase, vRutaPostProceso, vRegistro.fecha, aArchivos, vTamanoTelegram
+            ))
+            stTareasPostProceso.add(vTareaPostProceso)
+            vTareaPostProceso.add_done_callback(fAlTerminarPostProceso)
+          elif vCompleto:
+            fEscribirEntrada(vRegistro.id, vPrefijoBase, aArchivos, vTamanoTelegram)
+
+          vMarca = time.perf_counter()
+
+      await fEsperarPostProceso()
+      await fEntregarListos()
+    finally:
+      # Lo que ya está en el pool se termina y se apunta en el manifiesto aunque la descarga haya fallado
+      await fEsperarPostProceso()
+
+      # Los lotes ya entregados se terminan de borrar antes de salir, también si la descarga ha fallado
+      if vTareaBorrado is not None:
+        await vColaBorrado.put(None)
+        await vTareaBorrado
+
+  if aErroresBorrado:
+    console.print(
+      f"[bold red]{vPrefijoEtiqueta}Error borrando un lote:[/bold red] {aErroresBorrado[0]} "
+      f"({vCantidadBorrados} mensajes borrados antes del fallo)"
+    )
+    raise aErroresBorrado[0]
+
+  return vContadorProcesados, vCantidadMedia, vCantidadTextos, vCantidadOmitidos, vCantidadBorrados
+
+async def fProcesarMensajesArchivo(
+  pClient: TelegramClient,
+  pCfg: Config,
+  pTotalMensajes: int,
+  pArchivo: EscritorArchivo,
+  pChat: Union[str, int] = "me",
+  pRutaInterna: str = "",
+  pProgress: Optional[Progress] = None,
+  pEtiqueta: str = "",
+  pMetricas: Optional[Metricas] = None,
+  pEsperaEntrePaginas: Optional[float] = None
+) -> tuple[int, int, int, int, int]:
+  from rich.markup import escape
+
+  vMetricas = pMetricas or Metricas()
 
-  return vContadorProcesados, vCantidadMedia, vCantidadTextos, vCantidadOmitidos
+  vContadorProcesados = 0
+  vCantidadMedia = 0
+  vCantidadTextos = 0
 
-async def fContarMensajes(pClient: TelegramClient) -> int:
-  vResultado = await pClient.get_messages("me", limit=0)
+  vContextoProgress = fCrearProgress() if pProgress is None else contextlib.nullcontext(pProgress)
+  vPrefijoEtiqueta = escape(f"[{pEtiqueta}] ") if pEtiqueta else ""
+
+  with vContextoProgress as vProgress:
+    vTask = vProgress.add_task(f"{vPrefijoEtiqueta}Archivando Saved Messages...", total=pTotalMensajes)
+    vMarca = time.perf_counter()
+
+    async with PaginadorHistorial(
+      pClient, pChat, pCfg.limit, pCfg.page_size, pEsperaEntrePaginas or 0.0, pCfg.prefetch_pages, vMetricas
+    ) as vPaginador:
+      async for vRegistro in vPaginador:
+        vMetricas.fRegistrar("historial", time.perf_counter() - vMarca)
+        vMetricas.mensajes += 1
+        vContadorProcesados += 1
+        vPrefijoBase = fGenerarPrefijoBase(vRegistro)
+
+        vProgress.update(
+          vTask,
+          description=f"{vPrefijoEtiqueta}Archivando mensaje {vContadorProcesados} de {pTotalMensajes}",
+          completed=vContadorProcesados
+        )
+
+        vTamano = vRegistro.tamano
+        if vRegistro.descargable is not None and vTamano is not None:
+          # Mismo nombre que en disco; allí Telethon añade la extensión si falta, aquí se pone a mano
+          vNombre = f"{vPrefijoBase}-{fNombreMedia(vRegistro)}"
+          if not os.path.splitext(vNombre)[1]:
+            vNombre += vRegistro.extension or ""
+
+          # Los trozos van de Telegram al archivo según llegan: la memoria no depende del tamaño de la media
+          vInicio = time.perf_counter()
+          vRecibidos = await pArchivo.fEscribirMiembro(
+            pRutaInterna + vNombre, vRegistro.fecha, vTamano, fTrozosDeMedia(pClient, pChat, vRegistro)
+          )
+          vMetricas.fRegistrar("descarga_media", time.perf_counter() - vInicio, vRecibidos)
+
+          if vRecibidos == vTamano:
+            vCantidadMedia += 1
+          else:
+            console.print(
+              f"[yellow]{vPrefijoEtiqueta}Media incompleta en el mensaje {vRegistro.id} "
+              f"({vRecibidos} de {vTamano} bytes); en el archivo se ha rellenado con ceros.[/yellow]"
+            )
+
+        if vRegistro.texto:
+          vDatos = (vRegistro.texto + "\n").encode("utf-8")
+          vInicio = time.perf_counter()
+          await pArchivo.fEscribirMiembro(
+            pRutaInterna + fNombreArchivoDeTexto(vRegistro, vPrefijoBase), vRegistro.fecha, len(vDatos), fTrozosDeBytes(vDatos)
+          )
+          vMetricas.fRegistrar("escritura_texto", time.perf_counter() - vInicio, len(vDatos))
+          vCantidadTextos += 1
+
+        vMarca = time.perf_counter()
+
+  return vContadorProcesados, vCantidadMedia, vCantidadTextos, 0, 0
+
+async def fContarMensajes(pClient: TelegramClient, pChat: Union[str, int] = "me") -> int:
+  vResultado = await pClient.get_messages(pChat, limit=0)
   vTotal = getattr(vResultado, "total", None)
 
   if vTotal is None:
-    vResultado = await pClient.get_messages("me", limit=1)
+    vResultado = await pClient.get_messages(pChat, limit=1)
     vTotal = getattr(vResultado, "total", 0) or 0
 
   return vTotal
 
-async def fEjecutar(pCfg: Config) -> int:
+@dataclass
+class Trabajo:
+  sesion: str
+  chat: str
+  directorio: Path
+  total: Optional[int] = None
+  takeout: bool = False
+  procesados: int = 0
+  media: int = 0
+  textos: int = 0
+  omitidos: int = 0
+  borrados: int = 0
+  error: Optional[str] = None
+
+  @property
+  def etiqueta(self) -> str:
+    return f"{Path(self.sesion).name}/{self.chat}"
+
+async def fEjecutarTrabajo(
+  pClient: TelegramClient,
+  pCfg: Config,
+  pTrabajo: Trabajo,
+  pProgress: Progress,
+  pSemaforoGlobal: asyncio.Semaphore,
+  pSemaforoCuenta: asyncio.Semaphore,
+  pMetricas: Metricas,
+  pClienteBorrado: Optional[TelegramClient] = None,
+  pArchivo: Optional[EscritorArchivo] = None,
+  pPoolPostProceso: Optional[Executor] = None
+) -> None:
+  vEtiqueta = pTrabajo.etiqueta if len(pCfg.sessions) > 1 or len(pCfg.chats) > 1 else ""
+
+  # Primero el cupo de la cuenta: así un chat en espera no retiene un hueco global que podría usar otra cuenta
+  async with pSemaforoCuenta, pSemaforoGlobal:
+    try:
+      vChat = fParsearChat(pTrabajo.chat)
+      vTotalMensajes = pTrabajo.total
+      if vTotalMensajes is None:
+        vTotalMensajes = await fContarMensajes(pClient, vChat)
+
+      vTotalAProcesar = vTotalMensajes
+      if pCfg.limit is not None and pCfg.limit < vTotalMensajes:
+        vTotalAProcesar = pCfg.limit
+
+      # En takeout los límites de GetHistory son más generosos y Telethon recomienda no esperar entre páginas
+      vEsperaEntrePaginas = pCfg.page_delay
+      if vEsperaEntrePaginas is None:
+        vEsperaEntrePaginas = 0.0 if pTrabajo.takeout else cEsperaEntrePaginas
+
+      if pArchivo is not None:
+        # Dentro del archivo cada chat va en la misma ruta relativa que tendría bajo --output-dir
+        vRutaInterna = pTrabajo.directorio.relative_to(pCfg.output_dir).as_posix()
+        vRutaInterna = "" if vRutaInterna == "." else vRutaInterna + "/"
+        vCorrutina = fProcesarMensajesArchivo(
+          pClient, pCfg, vTotalAProcesar, pArchivo, vChat, vRutaInterna, pProgress, vEtiqueta, pMetricas, vEsperaEntrePaginas
+        )
+      else:
+        vCorrutina = fProcesarMensajes(
+          pClient,
+          pCfg,
+          vTotalAProcesar,
+          vChat,
+          pTrabajo.directorio,
+          pProgress,
+          vEtiqueta,
+          pMetricas,
+          vEsperaEntrePaginas,
+          pClienteBorrado,
+          pPoolPostProceso
+        )
+
+      pTrabajo.procesados, pTrabajo.media, pTrabajo.textos, pTrabajo.omitidos, pTrabajo.borrados = await vCorrutina
+    except Exception as e:
+      pTrabajo.error = str(e) or e.__class__.__name__
+      console.print(f"[bold red]Error exportando {pTrabajo.etiqueta}:[/bold red] {pTrabajo.error}")
+
+async def fAbrirTakeout(
+  pClient: TelegramClient,
+  pSesion: str,
+  pPila: contextlib.AsyncExitStack
+) -> Optional[TelegramClient]:
+  from telethon.errors import RPCError
+  from telethon.errors import TakeoutInitDelayError
+
+  vNombre = Path(pSesion).name
+
+  try:
+    return await pPila.enter_async_context(
+      pClient.takeout(
+        finalize=True,
+        users=True,
+        chats=True,
+        megagroups=True,
+        channels=True,
+        files=True,
+        max_file_size=cTamanoMaximoTakeout
+      )
+    )
+  except ValueError:
+    # Quedó una sesión takeout sin finalizar de una ejecución anterior: Telethon permite reutilizarla sin pedir otra
+    try:
+      vTakeout = await pPila.enter_async_context(pClient.takeout(finalize=True))
+      console.print(f"[cyan]Reutilizando la sesión takeout pendiente de {vNombre}.[/cyan]")
+      return vTakeout
+    except (ValueError, RPCError) as e:
+      console.print(f"[yellow]No se pudo reutilizar la sesión takeout de {vNombre} ({e}). Se continúa en modo normal.[/yellow]")
+  except TakeoutInitDelayError as e:
+    console.print(
+      f"[yellow]Telegram no ha concedido la sesión takeout de {vNombre}: hay que aceptarla desde otro dispositivo "
+      f"o esperar {e.seconds} s. Se continúa en modo normal.[/yellow]"
+    )
+  except RPCError as e:
+    console.print(f"[yellow]No se pudo abrir la sesión takeout de {vNombre} ({e}). Se continúa en modo normal.[/yellow]")
+
+  return None
+
+def fTrabajosComoDiccionario(paTrabajos: list[Trabajo]) -> dict:
+  return {
+    "trabajos": [
+      {
+        "cuenta_chat": vTrabajo.etiqueta,
+        "procesados": vTrabajo.procesados,
+        "omitidos": vTrabajo.omitidos,
+        "media": vTrabajo.media,
+        "textos": vTrabajo.textos,
+        "borrados": vTrabajo.borrados,
+        "error": vTrabajo.error
+      }
+      for vTrabajo in paTrabajos
+    ]
+  }
+
+async def fEscribirInstantaneas(pMetricas: Metricas, pCfg: Config, paTrabajos: list[Trabajo]) -> None:
+  while True:
+    await asyncio.sleep(pCfg.stats_interval)
+    pMetricas.fGuardarJSON(pCfg.stats_json, False, fTrabajosComoDiccionario(paTrabajos))
+
+async def fEjecutarTrabajos(
+  pCfg: Config,
+  paTrabajos: list[Trabajo],
+  pdClientes: dict[str, TelegramClient],
+  pMetricas: Metricas,
+  pdClientesBorrado: Optional[dict[str, TelegramClient]] = None,
+  pArchivo: Optional[EscritorArchivo] = None,
+  pPoolPostProceso: Optional[Executor] = None
+) -> None:
+  vTareaInstantaneas = None
+  pdClientesBorrado = pdClientesBorrado or pdClientes
+
+  if len(paTrabajos) == 1:
+    console.print("[cyan]Contando mensajes en Saved Messages...[/cyan]")
+    vTotalMensajes = await fContarMensajes(pdClientes[paTrabajos[0].sesion], fParsearChat(paTrabajos[0].chat))
+    paTrabajos[0].total = vTotalMensajes
+    console.print(f"[cyan]Total de mensajes en Saved Messages: [bold]{vTotalMensajes}[/bold][/cyan]\n")
+
+    if pCfg.limit is not None and pCfg.limit < vTotalMensajes:
+      console.print(f"[yellow]Se procesarán solo {pCfg.limit} mensajes (límite aplicado).[/yellow]\n")
+  else:
+    console.print(
+      f"[cyan]Exportando {len(pCfg.chats)} chat(s) de {len(pCfg.sessions)} cuenta(s) "
+      f"con hasta {pCfg.jobs} a la vez ({pCfg.per_account} por cuenta)...[/cyan]\n"
+    )
+
+  vSemaforoGlobal = asyncio.Semaphore(pCfg.jobs)
+  dSemaforosCuenta = {vSesion: asyncio.Semaphore(pCfg.per_account) for vSesion in pCfg.sessions}
+
+  if pCfg.stats_json and pCfg.stats_interval:
+    vTareaInstantaneas = asyncio.create_task(fEscribirInstantaneas(pMetricas, pCfg, paTrabajos))
+
+  try:
+    with fCrearProgress() as vProgress, pMetricas.fCapturarFloodWaits():
+      await asyncio.gather(*(
+        fEjecutarTrabajo(
+          pdClientes[vTrabajo.sesion],
+          pCfg,
+          vTrabajo,
+          vProgress,
+          vSemaforoGlobal,
+          dSemaforosCuenta[vTrabajo.sesion],
+          pMetricas,
+          pdClientesBorrado[vTrabajo.sesion],
+          pArchivo,
+          pPoolPostProceso
+        )
+        for vTrabajo in paTrabajos
+      ))
+  finally:
+    if vTareaInstantaneas:
+      vTareaInstantaneas.cancel()
+
+async def fEjecutar(pCfg: Config, pdClientes: Optional[dict[str, TelegramClient]] = None) -> int:
+  import multiprocessing
+
+  from concurrent.futures import ProcessPoolExecutor
+  from rich.panel import Panel
+  from rich.table import Table
+
   console.print(
     Panel.fit(
       "[bold green]Telegram Saved Messages Downloader[/bold green]\n"
@@ -341,49 +1947,295 @@ async def fEjecutar(pCfg: Config) -> int:
     )
   )
 
-  vClient = TelegramClient(pCfg.session, pCfg.api_id, pCfg.api_hash)
-
-  vTotal = 0
-  vCantidadMedia = 0
-  vCantidadTextos = 0
-  vCantidadOmitidos = 0
+  # pdClientes: conexiones ya abiertas y con sesión iniciada (las del demonio), que no se cierran al terminar
+  dClientes: dict[str, TelegramClient] = dict(pdClientes or {})
+  vMetricas = Metricas()
+  aTrabajos = [
+    Trabajo(sesion=vSesion, chat=vChat, directorio=fDirectorioDeTrabajo(pCfg, vSesion, vChat))
+    for vSesion in pCfg.sessions
+    for vChat in pCfg.chats
+  ]
 
   try:
-    await vClient.connect()
-    await fAsegurarLogin(vClient, pCfg)
+    # El login puede pedir OTP por terminal, así que las cuentas se conectan de una en una
+    for vSesion in pCfg.sessions:
+      if vSesion in dClientes:
+        continue
 
-    console.print("[cyan]Contando mensajes en Saved Messages...[/cyan]")
-    vTotalMensajes = await fContarMensajes(vClient)
-    console.print(f"[cyan]Total de mensajes en Saved Messages: [bold]{vTotalMensajes}[/bold][/cyan]\n")
+      vClient = fCrearCliente(pCfg, vSesion)
+      dClientes[vSesion] = vClient
+      await vClient.connect()
+      await fAsegurarLogin(vClient, pCfg)
+
+    # La pila envuelve toda la exportación para que, si algo revienta, Telethon finalice el takeout como fallido
+    async with contextlib.AsyncExitStack() as vPilaTakeout:
+      dClientesTrabajo = dict(dClientes)
+      aTakeouts = []
+
+      if pCfg.takeout:
+        for vSesion in pCfg.sessions:
+          vTakeout = await fAbrirTakeout(dClientes[vSesion], vSesion, vPilaTakeout)
+          if vTakeout is None:
+            continue
+
+          dClientesTrabajo[vSesion] = vTakeout
+          aTakeouts.append(vTakeout)
+          for vTrabajo in aTrabajos:
+            if vTrabajo.sesion == vSesion:
+              vTrabajo.takeout = True
+
+        if aTakeouts:
+          console.print(f"[cyan]Exportando a través de sesión takeout ({len(aTakeouts)} de {len(pCfg.sessions)} cuenta(s)).[/cyan]\n")
+
+      vArchivo = None
+      if pCfg.archive:
+        vArchivo = EscritorArchivo(pCfg.archive, pCfg.archive_format)
+        if pCfg.archive != "-" and Path(pCfg.archive).is_fifo():
+          console.print(f"[cyan]Esperando a que alguien lea de {pCfg.archive}...[/cyan]")
+        await vArchivo.fAbrir()
+
+      vPoolPostProceso = None
+      if pCfg.post_process:
+        # Fechas, EXIF y extensiones van en otros procesos para que el bucle de red no se pare a leer archivos.
+        # Se fuerza el fork ya con una tarea vacía, antes de que la descarga arranque hilos y conexiones nuevas
+        vContexto = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        vPoolPostProceso = vPilaTakeout.enter_context(
+          ProcessPoolExecutor(max_workers=pCfg.post_workers, mp_context=vContexto)
+        )
+        vPoolPostProceso.submit(int).result()
+
+      # Los borrados de --purge van por la conexión normal: una sesión takeout es solo para leer
+      await fEjecutarTrabajos(pCfg, aTrabajos, dClientesTrabajo, vMetricas, dClientes, vArchivo, vPoolPostProceso)
+
+      if vArchivo is not None:
+        await vArchivo.fCerrar()
+
+      if any(vTrabajo.error for vTrabajo in aTrabajos):
+        for vTakeout in aTakeouts:
+          # El proxy de Telethon reenvía al cliente cualquier atributo que no sea suyo: "success" no llegaría a __aexit__
+          vTakeout._TakeoutClient__success = False
+  finally:
+    for vSesion, vClient in dClientes.items():
+      if not pdClientes or vSesion not in pdClientes:
+        await vClient.disconnect()
+
+  if pCfg.stats_json:
+    vMetricas.fGuardarJSON(pCfg.stats_json, True, fTrabajosComoDiccionario(aTrabajos))
+
+  dInforme = vMetricas.fComoDiccionario(True)
+
+  if len(aTrabajos) > 1:
+    vTabla = Table(title="Chats exportados")
+    vTabla.add_column("Cuenta/Chat")
+    vTabla.add_column("Procesados", justify="right")
+    vTabla.add_column("Omitidos", justify="right")
+    vTabla.add_column("Multimedia", justify="right")
+    vTabla.add_column("Texto/url", justify="right")
+    if pCfg.purge:
+      vTabla.add_column("Borrados", justify="right")
+    vTabla.add_column("Estado")
+
+    for vTrabajo in aTrabajos:
+      vTabla.add_row(
+        vTrabajo.etiqueta,
+        str(vTrabajo.procesados),
+        str(vTrabajo.omitidos),
+        str(vTrabajo.media),
+        str(vTrabajo.textos),
+        *([str(vTrabajo.borrados)] if pCfg.purge else []),
+        f"[red]{vTrabajo.error}[/red]" if vTrabajo.error else "[green]OK[/green]"
+      )
 
-    vTotalAProcesar = vTotalMensajes
-    if pCfg.limit is not None and pCfg.limit < vTotalMensajes:
-      vTotalAProcesar = pCfg.limit
-      console.print(f"[yellow]Se procesarán solo {vTotalAProcesar} mensajes (límite aplicado).[/yellow]\n")
+    console.print(vTabla)
+
+  vLineaDestino = f"[bold]Carpeta de salida:[/bold] {pCfg.output_dir}"
+  if pCfg.archive:
+    vLineaDestino = f"[bold]Archivo ({pCfg.archive_format}):[/bold] {pCfg.archive}"
+
+  vLineaBorrados = ""
+  if pCfg.purge:
+    vLineaBorrados = f"[bold]Mensajes borrados de Telegram:[/bold] {vMetricas.borrados}\n"
 
-    vTotal, vCantidadMedia, vCantidadTextos, vCantidadOmitidos = await fProcesarMensajes(
-      vClient, pCfg, vTotalAProcesar
+  vLineaPostProceso = ""
+  if pCfg.post_process:
+    vLineaPostProceso = (
+      f"[bold]Post-proceso:[/bold] {vMetricas.exif_escritos} con fecha EXIF añadida, "
+      f"{vMetricas.extensiones_corregidas} extensiones corregidas\n"
     )
-  finally:
-    await vClient.disconnect()
 
   console.print(
     Panel.fit(
-      f"[bold]Mensajes procesados:[/bold] {vTotal}\n"
-      f"[bold]Mensajes omitidos (ya existían):[/bold] {vCantidadOmitidos}\n"
-      f"[bold]Archivos multimedia:[/bold] {vCantidadMedia}\n"
-      f"[bold]Archivos de texto/url:[/bold] {vCantidadTextos}\n"
-      f"[bold]Carpeta de salida:[/bold] {pCfg.output_dir}",
+      f"[bold]Mensajes procesados:[/bold] {sum(vTrabajo.procesados for vTrabajo in aTrabajos)}\n"
+      f"[bold]Mensajes omitidos (ya existían):[/bold] {sum(vTrabajo.omitidos for vTrabajo in aTrabajos)}\n"
+      f"[bold]Archivos multimedia:[/bold] {sum(vTrabajo.media for vTrabajo in aTrabajos)}\n"
+      f"[bold]Archivos de texto/url:[/bold] {sum(vTrabajo.textos for vTrabajo in aTrabajos)}\n"
+      f"{vLineaBorrados}"
+      f"{vLineaPostProceso}"
+      f"[bold]Tiempo total:[/bold] {dInforme['segundos']:.1f} s "
+      f"({dInforme['mensajes_por_segundo'] or 0:.1f} mensajes/s, {(dInforme['bytes_por_segundo'] or 0) / (1024 * 1024):.2f} MB/s)\n"
+      f"[bold]Esperas por flood wait:[/bold] {dInforme['flood_waits']['cantidad']} ({dInforme['flood_waits']['segundos']:.0f} s)\n"
+      f"{vLineaDestino}",
       title="Resumen",
       border_style="green"
     )
   )
 
-  return 0
+  return 1 if any(vTrabajo.error for vTrabajo in aTrabajos) else 0
+
+def fVerificarEntrada(pDirectorio: str, pVerificarHash: bool, pdEntrada: dict) -> Optional[str]:
+  # Se ejecuta en los procesos del pool: primero lo barato (existencia y tamaño) y el hash solo si se pide
+  for dArchivo in pdEntrada.get("archivos", []):
+    vRuta = Path(pDirectorio) / dArchivo["nombre"]
+
+    try:
+      vTamano = vRuta.stat().st_size
+    except FileNotFoundError:
+      return "falta"
+
+    if vTamano != dArchivo["bytes"]:
+      return "tamaño"
+
+    vTamanoTelegram = pdEntrada.get("telegram_bytes")
+    # Con el EXIF añadido por --post-process la media ya no mide lo que dice Telegram; el hash sigue valiendo
+    if dArchivo["tipo"] == "media" and vTamanoTelegram and vTamano != vTamanoTelegram and not pdEntrada.get("exif"):
+      return "incompleto"
+
+  if pVerificarHash:
+    for dArchivo in pdEntrada.get("archivos", []):
+      if fCalcularSHA256(Path(pDirectorio) / dArchivo["nombre"]) != dArchivo["sha256"]:
+        return "sha256"
+
+  return None
+
+def fVerificarExportacion(pCfg: Config) -> int:
+  import multiprocessing
+
+  from concurrent.futures import ProcessPoolExecutor
+  from rich.markup import escape
+  from rich.panel import Panel
+
+  console.print(
+    Panel.fit(
+      "[bold green]Telegram Saved Messages Downloader[/bold green]\n"
+      "Verificación de la exportación existente contra su manifiesto.",
+      title="TSMDownloader",
+      border_style="cyan"
+    )
+  )
+
+  aDirectorios = list(dict.fromkeys(
+    fDirectorioDeTrabajo(pCfg, vSesion, vChat) for vSesion in pCfg.sessions for vChat in pCfg.chats
+  ))
+  dMotivos: dict[str, int] = {}
+  vCantidadEntradas = 0
+  vCantidadMalas = 0
+
+  # fork deja que los procesos hereden el script aunque se haya ejecutado con curl | python3 -
+  vContexto = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+
+  with ProcessPoolExecutor(max_workers=pCfg.verify_workers, mp_context=vContexto) as vPool, fCrearProgress() as vProgress:
+    for vDirectorio in aDirectorios:
+      dManifiesto = fCargarManifiesto(vDirectorio)
+      aEntradas = [dEntrada for dEntrada in dManifiesto.values() if not dEntrada.get("pendiente")]
+
+      if not aEntradas:
+        console.print(f"[yellow]Sin manifiesto o vacío en {vDirectorio}[/yellow]")
+        continue
+
+      vTask = vProgress.add_task(f"Verificando {escape(str(vDirectorio))}", total=len(aEntradas))
+      vVerificar = functools.partial(fVerificarEntrada, str(vDirectorio), pCfg.verify_hash)
+      vCantidadEntradas += len(aEntradas)
+
+      for dEntrada, vMotivo in zip(aEntradas, vPool.map(vVerificar, aEntradas, chunksize=256)):
+        vProgress.advance(vTask)
+        if vMotivo is None:
+          continue
+
+        vCantidadMalas += 1
+        dMotivos[vMotivo] = dMotivos.get(vMotivo, 0) + 1
+        # La entrada queda pendiente: la próxima exportación borra sus restos y la vuelve a descargar
+        dManifiesto[dEntrada["id"]] = {**dEntrada, "pendiente": True, "motivo": vMotivo}
+
+      fCompactarManifiesto(vDirectorio, dManifiesto)
+
+  vDetalle = ", ".join(f"{vMotivo}: {vCantidad}" for vMotivo, vCantidad in sorted(dMotivos.items())) or "-"
+
+  console.print(
+    Panel.fit(
+      f"[bold]Mensajes comprobados:[/bold] {vCantidadEntradas}\n"
+      f"[bold]Correctos:[/bold] {vCantidadEntradas - vCantidadMalas}\n"
+      f"[bold]Dañados (pendientes de volver a descargar):[/bold] {vCantidadMalas}\n"
+      f"[bold]Motivos:[/bold] {vDetalle}\n"
+      f"[bold]Hash comprobado:[/bold] {'sí' if pCfg.verify_hash else 'no'}",
+      title="Verificación",
+      border_style="red" if vCantidadMalas else "green"
+    )
+  )
+
+  return 1 if vCantidadMalas else 0
+
+def fEjecutarEnDemonio(pTipo: str, paArgumentos: list[str]) -> Optional[int]:
+  """Manda el trabajo a tsmdaemon.py si está en marcha. Devuelve None si no hay demonio o no puede atenderlo."""
+  if not cRutaSocketDemonio.exists():
+    return None
+
+  vSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    vSocket.connect(str(cRutaSocketDemonio))
+  except OSError:
+    # Socket huérfano de un demonio que ya no está en marcha
+    vSocket.close()
+    return None
+
+  dPeticion = {
+    "tipo": pTipo,
+    "argumentos": paArgumentos,
+    "cwd": os.getcwd(),
+    "tty": sys.stdout.isatty(),
+    "ancho": shutil.get_terminal_size().columns
+  }
+
+  with vSocket, vSocket.makefile("rwb") as vCanal:
+    vCanal.write((json.dumps(dPeticion) + "\n").encode("utf-8"))
+    vCanal.flush()
+
+    for vLinea in vCanal:
+      dMensaje = json.loads(vLinea)
+
+      if dMensaje["tipo"] == "salida":
+        sys.stdout.write(dMensaje["texto"])
+        sys.stdout.flush()
+      elif dMensaje["tipo"] == "rechazado":
+        print(f"[INFO] El demonio no puede atender este trabajo ({dMensaje['motivo']}); se ejecuta aquí.", file=sys.stderr)
+        return None
+      elif dMensaje["tipo"] == "fin":
+        return dMensaje["codigo"]
+
+  print("[ERROR] El demonio cerró la conexión sin terminar el trabajo.", file=sys.stderr)
+  return 1
 
 def main() -> None:
   vCfg = fParsearArgumentos()
 
+  if vCfg.archive == "-":
+    console.stderr = True
+
+  # --verify no usa Telegram y --archive escribe en la salida de este proceso; lo demás se manda al demonio si hay uno
+  if not vCfg.verify and not vCfg.archive and not vCfg.no_daemon:
+    try:
+      vCodigo = fEjecutarEnDemonio("download", sys.argv[1:])
+    except KeyboardInterrupt:
+      print("\nCancelado por el usuario.", file=sys.stderr)
+      raise SystemExit(130)
+
+    if vCodigo is not None:
+      raise SystemExit(vCodigo)
+
+  fAsegurarDependencias()
+
+  if vCfg.verify:
+    raise SystemExit(fVerificarExportacion(vCfg))
+
   try:
     raise SystemExit(asyncio.run(fEjecutar(vCfg)))
   except KeyboardInterrupt:
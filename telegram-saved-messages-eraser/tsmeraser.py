@@ -15,6 +15,8 @@
 #   curl -sL https://raw.githubusercontent.com/nipegun/nipepruebas/refs/heads/main/telegram-saved-messages-eraser/tsmeraser.py | nano -
 # ----------
 
+from __future__ import annotations
+
 # ------ Inicio del bloque de instalación de dependencias de paquetes python ------
 
 # Definir los paquetes python que necesita este script siguiendo la convención de diccionario:
@@ -26,16 +28,23 @@ dPaquetesPython = {
 
 import getpass
 import importlib.util
+import json
 import os
 import shutil
 import subprocess
 import sys
 
 from dataclasses import dataclass
+from dataclasses import replace
+from pathlib import Path
+from typing import TYPE_CHECKING
 from typing import Optional
 
 cNombreDelPaqueteApt = "python3-pip"
 
+# Sello que recuerda que las dependencias ya se comprobaron con este intérprete y estas versiones instaladas
+cRutaSelloDependencias = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "nipepruebas" / "tsm-dependencias.json"
+
 def fPaqueteAptEstaInstalado(pNombreDelPaqueteApt):
   vResultado = subprocess.run(
     ["dpkg", "-s", pNombreDelPaqueteApt],
@@ -97,41 +106,145 @@ def fComprobarEInstalarPaquetes(pdPaquetesPython):
 
   return aErrores
 
-print("=== Comprobando dependencias ===\n")
+def fHuellaDependencias(pdPaquetesPython):
+  # Ruta, mtime y tamaño del archivo de cada módulo: cambian en cuanto pip instala otra versión
+  importlib.invalidate_caches()
+  dHuella = {"python": sys.executable, "version": sys.version, "modulos": {}}
 
-if not fPaqueteAptEstaInstalado(cNombreDelPaqueteApt):
-  fInstalarPaqueteApt(cNombreDelPaqueteApt)
-else:
-  print(f"[OK] {cNombreDelPaqueteApt} ya está instalado")
+  for vNombreModulo in pdPaquetesPython:
+    vOrigen = importlib.util.find_spec(vNombreModulo).origin
+    vStat = os.stat(vOrigen)
+    dHuella["modulos"][vNombreModulo] = [vOrigen, vStat.st_mtime_ns, vStat.st_size]
 
-print()
+  return dHuella
+
+def fSelloDependenciasEsValido(pdPaquetesPython):
+  try:
+    dSello = json.loads(cRutaSelloDependencias.read_text(encoding="utf-8"))
+  except (OSError, ValueError):
+    return False
 
-aErrores = fComprobarEInstalarPaquetes(dPaquetesPython)
+  if dSello.get("python") != sys.executable or dSello.get("version") != sys.version:
+    return False
 
-print("\n=== Resumen ===")
-if aErrores:
-  print(f"[AVISO] Paquetes con errores: {', '.join(aErrores)}")
-  sys.exit(1)
-else:
-  print("[OK] Todas las dependencias instaladas correctamente")
+  dModulos = dSello.get("modulos", {})
+  if set(dModulos) != set(pdPaquetesPython):
+    return False
+
+  # En el camino rápido solo se hace stat de los archivos apuntados: ni dpkg ni find_spec
+  for vOrigen, vMtime, vTamano in dModulos.values():
+    try:
+      vStat = os.stat(vOrigen)
+    except (OSError, TypeError):
+      return False
+
+    if vStat.st_mtime_ns != vMtime or vStat.st_size != vTamano:
+      return False
+
+  return True
+
+def fGuardarSelloDependencias(pdPaquetesPython):
+  try:
+    cRutaSelloDependencias.parent.mkdir(parents=True, exist_ok=True)
+    cRutaSelloDependencias.write_text(json.dumps(fHuellaDependencias(pdPaquetesPython)), encoding="utf-8")
+  except (AttributeError, OSError, TypeError):
+    # Sin sello simplemente se vuelve a comprobar todo en la siguiente ejecución
+    pass
+
+def fAsegurarDependencias():
+  if fSelloDependenciasEsValido(dPaquetesPython):
+    return
+
+  print("=== Comprobando dependencias ===\n")
+
+  if not fPaqueteAptEstaInstalado(cNombreDelPaqueteApt):
+    fInstalarPaqueteApt(cNombreDelPaqueteApt)
+  else:
+    print(f"[OK] {cNombreDelPaqueteApt} ya está instalado")
+
+  print()
+
+  aErrores = fComprobarEInstalarPaquetes(dPaquetesPython)
+
+  print("\n=== Resumen ===")
+  if aErrores:
+    print(f"[AVISO] Paquetes con errores: {', '.join(aErrores)}")
+    sys.exit(1)
+  else:
+    print("[OK] Todas las dependencias instaladas correctamente")
+    fGuardarSelloDependencias(dPaquetesPython)
 
 # ------ Fin del bloque de instalación de dependencias ------
 # ------ A partir de aquí va el código real del script ------
 
 import argparse
 import asyncio
-
-from rich.console import Console
-from rich.panel import Panel
-from rich.progress import BarColumn
-from rich.progress import Progress
-from rich.progress import SpinnerColumn
-from rich.progress import TextColumn
-from rich.progress import TimeElapsedColumn
-from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError
-
-console = Console()
+import functools
+import logging
+import re
+import socket
+import threading
+import time
+
+from datetime import datetime
+from datetime import timedelta
+
+# rich y telethon se importan dentro de las funciones que los usan: --help no paga su carga
+if TYPE_CHECKING:
+  from rich.progress import Progress
+  from telethon import TelegramClient
+
+class ConsolaPerezosa:
+  """Crea la Console de rich la primera vez que se usa, para no importar rich al arrancar."""
+
+  def __init__(self):
+    self._consola = None
+
+  def fReal(self):
+    if self._consola is None:
+      from rich.console import Console
+      self._consola = Console()
+    return self._consola
+
+  def __getattr__(self, pNombre):
+    return getattr(self.fReal(), pNombre)
+
+def fConsolaRich():
+  # rich necesita una Console de verdad (por ejemplo para Progress), no el envoltorio perezoso
+  return console.fReal() if isinstance(console, ConsolaPerezosa) else console
+
+console = ConsolaPerezosa()
+
+# Máximo de ids que Telegram acepta en una sola petición de borrado
+cTamanoLote = 100
+
+# Socket de tsmdaemon.py: si hay un demonio escuchando, el trabajo se le manda a él en lugar de conectar desde aquí
+cRutaSocketDemonio = Path(
+  os.environ.get("TSM_DAEMON_SOCKET")
+  or Path(os.environ.get("XDG_RUNTIME_DIR") or Path.home() / ".cache") / "nipepruebas" / "tsm-daemon.sock"
+)
+
+# Regulación de los borrados: el lote baja si una petición tarda más que esto y sube tras varios éxitos seguidos
+cTamanoLoteMinimo = 10
+cLatenciaObjetivo = 2.0
+cExitosParaSubir = 5
+
+# Logger donde Telethon avisa de los flood waits que duerme por su cuenta (por debajo de flood_sleep_threshold)
+cLoggerFloodTelethon = "telethon.client.users"
+
+# --media -> filtro de Telegram que hace la selección en el servidor (None: se filtra al leer)
+dFiltrosMedia = {
+  "photo": "InputMessagesFilterPhotos",
+  "video": "InputMessagesFilterVideo",
+  "document": "InputMessagesFilterDocument",
+  "voice": "InputMessagesFilterVoice",
+  "audio": "InputMessagesFilterMusic",
+  "gif": "InputMessagesFilterGif",
+  "round": "InputMessagesFilterRoundVideo",
+  "url": "InputMessagesFilterUrl",
+  "any": None,
+  "text": None
+}
 
 @dataclass
 class Config:
@@ -142,10 +255,38 @@ class Config:
   code: Optional[str]
   password: Optional[str]
   limit: Optional[int]
+  workers: int = 4
+  bulk: bool = False
+  after: Optional[datetime] = None
+  before: Optional[datetime] = None
+  media: Optional[str] = None
+  from_user: Optional[str] = None
+  forwarded_from: Optional[str] = None
+  search: Optional[str] = None
+  match: Optional[re.Pattern] = None
+  journal: Optional[str] = None
+  resume: bool = True
+  dry_run: Optional[str] = None
+  no_daemon: bool = False
+
+def fParsearFecha(pValor: str) -> datetime:
+  try:
+    vFecha = datetime.fromisoformat(pValor)
+  except ValueError:
+    raise argparse.ArgumentTypeError(f"fecha no válida: {pValor} (usa AAAA-MM-DD o AAAA-MM-DDTHH:MM)")
+
+  # Sin zona horaria se interpreta como hora local
+  return vFecha if vFecha.tzinfo else vFecha.astimezone()
+
+def fParsearPatron(pValor: str) -> re.Pattern:
+  try:
+    return re.compile(pValor)
+  except re.error as e:
+    raise argparse.ArgumentTypeError(f"expresión regular no válida: {e}")
 
-def fParsearArgumentos() -> Config:
+def fParsearArgumentos(paArgumentos: Optional[list[str]] = None) -> Config:
   vParser = argparse.ArgumentParser(
-    description="Borra todos los mensajes de 'Saved Messages'."
+    description="Borra todos los mensajes de 'Saved Messages' (o solo los que cumplan los filtros)."
   )
   vParser.add_argument("--api-id", type=int, required=True, help="Telegram API ID")
   vParser.add_argument("--api-hash", required=True, help="Telegram API hash")
@@ -158,8 +299,62 @@ def fParsearArgumentos() -> Config:
   vParser.add_argument("--code", help="Código OTP de Telegram")
   vParser.add_argument("--password", help="Contraseña 2FA")
   vParser.add_argument("--limit", type=int, help="Límite de mensajes a borrar (opcional)")
+  vParser.add_argument(
+    "--bulk",
+    action="store_true",
+    help="Vaciar el chat en el servidor con messages.DeleteHistory, sin leer mensaje a mensaje (solo para borrados completos)"
+  )
+  vParser.add_argument("--after", type=fParsearFecha, help="Borrar solo mensajes posteriores a esta fecha (AAAA-MM-DD)")
+  vParser.add_argument("--before", type=fParsearFecha, help="Borrar solo mensajes anteriores a esta fecha (AAAA-MM-DD)")
+  vParser.add_argument(
+    "--keep-days",
+    type=int,
+    help="Conservar los mensajes de los últimos N días (equivale a --before hace N días)"
+  )
+  vParser.add_argument(
+    "--media",
+    choices=list(dFiltrosMedia),
+    help="Borrar solo un tipo de mensaje: photo, video, document, voice, audio, gif, round, url, any (cualquier media) o text (sin media)"
+  )
+  vParser.add_argument("--from-user", help="Borrar solo mensajes enviados por este usuario")
+  vParser.add_argument(
+    "--forwarded-from",
+    help="Borrar solo mensajes reenviados desde este chat/usuario ('any' para cualquier reenviado)"
+  )
+  vParser.add_argument("--search", help="Borrar solo mensajes que contengan este texto (búsqueda de Telegram)")
+  vParser.add_argument("--match", type=fParsearPatron, help="Borrar solo mensajes cuyo texto cumpla esta expresión regular")
+  vParser.add_argument(
+    "--workers",
+    type=int,
+    default=4,
+    help="Peticiones de borrado en paralelo mientras se sigue leyendo el historial (default: 4)"
+  )
+  vParser.add_argument(
+    "--journal",
+    help="Diario de lotes borrados para poder reanudar (default: <session>.borrado.jsonl)"
+  )
+  vParser.add_argument(
+    "--no-resume",
+    action="store_true",
+    help="No reanudar desde el diario: empezar a recorrer el historial desde el principio"
+  )
+  vParser.add_argument(
+    "--dry-run",
+    metavar="PLAN",
+    help="No borrar nada: escribir en PLAN los tramos de ids que se borrarían y cuántos hay en cada uno"
+  )
+  vParser.add_argument(
+    "--no-daemon",
+    action="store_true",
+    help="Conectar desde este proceso aunque haya un tsmdaemon.py en marcha"
+  )
+
+  vArgs = vParser.parse_args(paArgumentos)
 
-  vArgs = vParser.parse_args()
+  vAntes = vArgs.before
+  if vArgs.keep_days is not None:
+    vLimiteConservar = datetime.now().astimezone() - timedelta(days=vArgs.keep_days)
+    vAntes = min(vAntes, vLimiteConservar) if vAntes else vLimiteConservar
 
   return Config(
     api_id=vArgs.api_id,
@@ -168,7 +363,20 @@ def fParsearArgumentos() -> Config:
     session=vArgs.session,
     code=vArgs.code,
     password=vArgs.password,
-    limit=vArgs.limit
+    limit=vArgs.limit,
+    workers=max(1, vArgs.workers),
+    bulk=vArgs.bulk,
+    after=vArgs.after,
+    before=vAntes,
+    media=vArgs.media,
+    from_user=vArgs.from_user,
+    forwarded_from=vArgs.forwarded_from,
+    search=vArgs.search,
+    match=vArgs.match,
+    journal=vArgs.journal or f"{vArgs.session}.borrado.jsonl",
+    resume=not vArgs.no_resume,
+    dry_run=vArgs.dry_run,
+    no_daemon=vArgs.no_daemon
   )
 
 def fLeerDesdeTTY(pPrompt: str, pOculto: bool = False) -> str:
@@ -211,7 +419,14 @@ def fObtenerPassword2FA(pCfg: Config) -> str:
     password=True
   )
 
+def fCrearCliente(pCfg: Config) -> TelegramClient:
+  from telethon import TelegramClient
+
+  return TelegramClient(pCfg.session, pCfg.api_id, pCfg.api_hash)
+
 async def fAsegurarLogin(pClient: TelegramClient, pCfg: Config) -> None:
+  from telethon.errors import SessionPasswordNeededError
+
   if await pClient.is_user_authorized():
     return
 
@@ -229,55 +444,608 @@ async def fAsegurarLogin(pClient: TelegramClient, pCfg: Config) -> None:
     vPassword = fObtenerPassword2FA(pCfg)
     await pClient.sign_in(password=vPassword)
 
-async def fBorrarMensajes(pClient: TelegramClient, pCfg: Config, pTotalMensajes: int) -> int:
-  vContadorBorrados = 0
-  vIdsLote = []
+def fHayFiltros(pCfg: Config) -> bool:
+  return any(
+    vValor is not None
+    for vValor in (pCfg.after, pCfg.before, pCfg.media, pCfg.from_user, pCfg.forwarded_from, pCfg.search, pCfg.match)
+  )
+
+def fHayFiltrosLocales(pCfg: Config) -> bool:
+  # Los que Telegram no sabe aplicar y hay que evaluar mensaje a mensaje mientras se lee el historial.
+  # --from-user también: en Saved Messages el servidor no filtra por remitente.
+  return (
+    pCfg.match is not None
+    or pCfg.forwarded_from is not None
+    or pCfg.from_user is not None
+    or (pCfg.media is not None and dFiltrosMedia[pCfg.media] is None)
+  )
+
+def fFiltroTelegram(pCfg: Config):
+  if pCfg.media is None or dFiltrosMedia[pCfg.media] is None:
+    return None
+
+  from telethon.tl import types
+
+  return getattr(types, dFiltrosMedia[pCfg.media])()
+
+def fArgumentosIterMessages(pCfg: Config) -> dict:
+  # Lo que se puede empujar al servidor. --before no tiene equivalente en orden cronológico: se corta al llegar.
+  # --after tampoco va como offset_date: con search o filter Telethon lo manda como max_date, justo al revés
+  # en orden cronológico. Se convierte antes en un min_id (fIdDesdeFecha).
+  return {
+    "filter": fFiltroTelegram(pCfg),
+    "search": pCfg.search
+  }
+
+def fMensajeCumpleFiltros(
+  pMessage, pCfg: Config, pIdReenvio: Optional[int], pIdRemitente: Optional[int] = None
+) -> bool:
+  if pIdRemitente is not None and pMessage.sender_id != pIdRemitente:
+    return False
+
+  if pCfg.media == "any" and not pMessage.media:
+    return False
 
-  with Progress(
+  if pCfg.media == "text" and pMessage.media:
+    return False
+
+  if pCfg.forwarded_from is not None:
+    vReenvio = pMessage.fwd_from
+    if vReenvio is None:
+      return False
+
+    if pIdReenvio is not None:
+      from telethon import utils
+
+      if vReenvio.from_id is None or utils.get_peer_id(vReenvio.from_id) != pIdReenvio:
+        return False
+
+  if pCfg.match is not None and not pCfg.match.search(pMessage.message or ""):
+    return False
+
+  return True
+
+async def fResolverReenvio(pClient: TelegramClient, pCfg: Config) -> Optional[int]:
+  if pCfg.forwarded_from is None or pCfg.forwarded_from == "any":
+    return None
+
+  return await pClient.get_peer_id(pCfg.forwarded_from)
+
+async def fResolverRemitente(pClient: TelegramClient, pCfg: Config) -> Optional[int]:
+  if pCfg.from_user is None:
+    return None
+
+  return await pClient.get_peer_id(pCfg.from_user)
+
+async def fIdDesdeFecha(pClient: TelegramClient, pFecha: Optional[datetime]) -> int:
+  """Id del último mensaje no posterior a pFecha, o 0: como min_id deja fuera todo lo que no es posterior."""
+  if pFecha is None:
+    return 0
+
+  # offset_date es exclusivo y las fechas de Telegram van por segundos: un segundo más incluye lo enviado en pFecha
+  aMensajes = await fPedirConEspera(pClient.get_messages, "me", offset_date=pFecha + timedelta(seconds=1), limit=1)
+  return aMensajes[0].id if aMensajes else 0
+
+@functools.lru_cache(maxsize=None)
+def fTipoMedia(pClase: type) -> str:
+  # Una sola cadena por clase de media, compartida por todos los registros
+  return pClase.__name__.removeprefix("MessageMedia").lower()
+
+class RegistroMensaje:
+  """Lo que el borrado conserva de cada Message una vez filtrado, sin el grafo de entidades que cuelga de él.
+
+  Los filtros locales se evalúan sobre el Message recién llegado y a partir de ahí solo viaja esto, así
+  que los lotes, el diario y el plan nunca retienen mensajes de Telethon.
+  """
+
+  __slots__ = ("id", "fecha", "tipo_media", "id_archivo", "tamano", "longitud_texto")
+
+  def __init__(self, pMessage):
+    vArchivo = pMessage.file if pMessage.media else None
+    self.id = pMessage.id
+    self.fecha = pMessage.date
+    self.tipo_media = fTipoMedia(type(pMessage.media)) if pMessage.media else None
+    self.id_archivo = getattr(getattr(vArchivo, "media", None), "id", None)
+    self.tamano = vArchivo.size if vArchivo else None
+    self.longitud_texto = len(pMessage.message or "")
+
+async def fIterarMensajesFiltrados(
+  pClient: TelegramClient,
+  pCfg: Config,
+  pIdReenvio: Optional[int] = None,
+  pMinId: int = 0,
+  pRegulador: Optional[ReguladorBorrado] = None,
+  pIdRemitente: Optional[int] = None
+):
+  from telethon.errors import FloodWaitError
+
+  # Con filtros locales el --limit cuenta coincidencias, así que no se puede pasar al servidor
+  vLimiteServidor = None if fHayFiltrosLocales(pCfg) else pCfg.limit
+  vCoincidencias = 0
+  vVistos = 0
+  vUltimoId = pMinId
+
+  while True:
+    vLimite = None if vLimiteServidor is None else vLimiteServidor - vVistos
+    try:
+      async for vMessage in pClient.iter_messages(
+        "me", reverse=True, limit=vLimite, min_id=vUltimoId, **fArgumentosIterMessages(pCfg)
+      ):
+        vVistos += 1
+        vUltimoId = vMessage.id
+
+        if pCfg.before is not None and vMessage.date >= pCfg.before:
+          # Se recorre del más antiguo al más reciente: a partir de aquí ya nada es anterior a --before
+          return
+
+        if pCfg.after is not None and vMessage.date <= pCfg.after:
+          # Red por si el min_id de --after no cuadra con las fechas (p. ej. pFecha con fracciones de segundo)
+          continue
+
+        if not fMensajeCumpleFiltros(vMessage, pCfg, pIdReenvio, pIdRemitente):
+          continue
+
+        yield RegistroMensaje(vMessage)
+
+        vCoincidencias += 1
+        if pCfg.limit is not None and vCoincidencias >= pCfg.limit:
+          return
+      return
+    except FloodWaitError as e:
+      # Los flood waits largos de la paginación se esperan y se sigue tras el último id visto, sin abortar el borrado
+      if pRegulador is not None:
+        pRegulador.fRegistrarFloodWait(e.seconds)
+        await pRegulador.fEsperarPausa()
+      else:
+        await asyncio.sleep(e.seconds)
+
+class DiarioBorrado:
+  """Diario JSONL de solo añadir: un registro por lote, forzado a disco antes de darlo por borrado."""
+
+  def __init__(self, pRuta: str, pSincronizar: bool = True):
+    self.ruta = Path(pRuta)
+    self.sincronizar = pSincronizar
+    self._archivo = None
+    # Los trabajadores de borrado escriben desde hilos distintos: cada registro entra entero y en orden
+    self._cerrojo = threading.Lock()
+
+  def __enter__(self) -> DiarioBorrado:
+    self._archivo = open(self.ruta, "a", encoding="utf-8")
+    return self
+
+  def __exit__(self, *pExcepcion) -> None:
+    self._archivo.close()
+    self._archivo = None
+
+  def fEscribir(self, pdRegistro: dict) -> None:
+    with self._cerrojo:
+      self._archivo.write(json.dumps(pdRegistro, ensure_ascii=False) + "\n")
+      self._archivo.flush()
+
+      # Un fsync por lote de 100 ids cuesta mucho menos que la petición de borrado que lo precede
+      if self.sincronizar:
+        os.fsync(self._archivo.fileno())
+
+  async def fEscribirAsincrono(self, pdRegistro: dict) -> None:
+    # El fsync se hace en un hilo para no parar el bucle de eventos mientras otros lotes esperan respuesta
+    await asyncio.to_thread(self.fEscribir, pdRegistro)
+
+def fFirmaFiltros(pCfg: Config) -> dict:
+  # --before y --limit no entran: --keep-days mueve --before en cada ejecución y el límite se descuenta al reanudar
+  return {
+    "after": pCfg.after.isoformat() if pCfg.after else None,
+    "media": pCfg.media,
+    "from_user": pCfg.from_user,
+    "forwarded_from": pCfg.forwarded_from,
+    "search": pCfg.search,
+    "match": pCfg.match.pattern if pCfg.match else None
+  }
+
+def fLeerPuntoDeReanudacion(pRuta: str, pdFirma: dict) -> tuple[int, int]:
+  """Devuelve (min_id, borrados) de un borrado que quedó a medias con los mismos filtros, o (0, 0)."""
+  try:
+    vArchivo = open(pRuta, "r", encoding="utf-8")
+  except FileNotFoundError:
+    return 0, 0
+
+  dEjecucion = None
+  with vArchivo:
+    for vLinea in vArchivo:
+      try:
+        dRegistro = json.loads(vLinea)
+      except ValueError:
+        # Una línea cortada por un corte de luz: ese lote no llegó a confirmarse
+        continue
+
+      if dRegistro.get("tipo") == "inicio":
+        dEjecucion = {**dRegistro, "lotes": {}}
+      elif dRegistro.get("tipo") == "lote" and dEjecucion is not None:
+        dEjecucion["lotes"][dRegistro["n"]] = dRegistro
+      elif dRegistro.get("tipo") == "fin":
+        dEjecucion = None
+
+  if dEjecucion is None or dEjecucion.get("firma") != pdFirma:
+    return 0, 0
+
+  # Los lotes se borran en paralelo y pueden confirmarse desordenados: solo vale el tramo contiguo desde el primero
+  vMinId = dEjecucion["min_id"]
+  vLote = 0
+  while vLote in dEjecucion["lotes"]:
+    vMinId = max(vMinId, dEjecucion["lotes"][vLote]["hasta"])
+    vLote += 1
+
+  vBorrados = dEjecucion["borrados_previos"] + sum(dLote["ids"] for dLote in dEjecucion["lotes"].values())
+  return vMinId, vBorrados
+
+class ReguladorBorrado:
+  """Ajusta tamaño de lote y peticiones en paralelo según la latencia y los flood waits que devuelve Telegram."""
+
+  def __init__(self, pConcurrenciaMaxima: int):
+    self.tamano_lote = cTamanoLote
+    self.concurrencia_maxima = pConcurrenciaMaxima
+    self.concurrencia = pConcurrenciaMaxima
+    self.en_vuelo = 0
+    self.flood_waits = 0
+    self.segundos_frenado = 0.0
+    self.inicio = time.perf_counter()
+    self._reanudar_en = 0.0
+    self._exitos = 0
+    self._condicion = asyncio.Condition()
+
+  async def fAdquirir(self) -> None:
+    # Solo el hueco: la pausa por flood wait la espera el llamador dentro del try que libera el hueco al cancelarse
+    async with self._condicion:
+      await self._condicion.wait_for(lambda: self.en_vuelo < self.concurrencia)
+      self.en_vuelo += 1
+
+  async def fLiberar(self) -> None:
+    async with self._condicion:
+      self.en_vuelo -= 1
+      self._condicion.notify_all()
+
+  async def fEsperarPausa(self) -> None:
+    # Tras un flood wait nadie envía nada hasta que pase el tiempo que pidió el servidor
+    while (vEspera := self._reanudar_en - time.monotonic()) > 0:
+      await asyncio.sleep(vEspera)
+
+  def fRegistrarExito(self, pLatencia: float, pFloodWaitsAntes: int) -> None:
+    if self.flood_waits != pFloodWaitsAntes:
+      # La latencia incluye una espera por flood wait y no dice nada del tamaño del lote
+      return
+
+    if pLatencia > cLatenciaObjetivo:
+      self.tamano_lote = max(cTamanoLoteMinimo, self.tamano_lote // 2)
+      self._exitos = 0
+      return
+
+    # Tanteo hacia arriba: lote más grande y una petición más en paralelo, hasta que Telegram vuelva a frenar
+    self._exitos += 1
+    if self._exitos >= cExitosParaSubir:
+      self._exitos = 0
+      self.tamano_lote = min(cTamanoLote, self.tamano_lote * 2)
+      self.concurrencia = min(self.concurrencia_maxima, self.concurrencia + 1)
+
+  def fRegistrarFloodWait(self, pSegundos: float) -> None:
+    vAhora = time.monotonic()
+    vReanudar = vAhora + pSegundos
+
+    # Varias peticiones pueden recibir la misma espera: solo cuenta el tiempo de pausa que se añade
+    if vReanudar > self._reanudar_en:
+      self.segundos_frenado += vReanudar - max(vAhora, self._reanudar_en)
+      self._reanudar_en = vReanudar
+
+    self.flood_waits += 1
+    self.concurrencia = max(1, self.concurrencia // 2)
+    self._exitos = 0
+
+  def fDescripcion(self, pBorrados: int, pTotal: int, pCota: bool = False) -> str:
+    vSegundos = time.perf_counter() - self.inicio
+    vVelocidad = pBorrados / vSegundos if vSegundos else 0.0
+    vTotal = f"hasta {pTotal}" if pCota else pTotal
+    return (
+      f"Borrados {pBorrados} de {vTotal} · {vVelocidad:.0f}/s · "
+      f"frenado {self.segundos_frenado:.0f}s · lote {self.tamano_lote}×{self.concurrencia}"
+    )
+
+class ManejadorFloodWait(logging.Handler):
+  def __init__(self, pRegulador: ReguladorBorrado):
+    super().__init__(logging.INFO)
+    self.regulador = pRegulador
+
+  def emit(self, pRegistro: logging.LogRecord) -> None:
+    # Telethon registra ('Sleeping%s for %ds (%s) on %s flood wait', early, segundos, timedelta, petición)
+    if "flood wait" not in str(pRegistro.msg) or not isinstance(pRegistro.args, tuple) or len(pRegistro.args) < 2:
+      return
+
+    try:
+      self.regulador.fRegistrarFloodWait(float(pRegistro.args[1]))
+    except (TypeError, ValueError):
+      pass
+
+def fCrearProgress() -> Progress:
+  from rich.progress import BarColumn
+  from rich.progress import Progress
+  from rich.progress import SpinnerColumn
+  from rich.progress import TextColumn
+  from rich.progress import TimeElapsedColumn
+
+  return Progress(
     SpinnerColumn(),
     TextColumn("[progress.description]{task.description}"),
     BarColumn(),
     TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
     TimeElapsedColumn(),
-    console=console
-  ) as vProgress:
-    vTask = vProgress.add_task("Borrando Saved Messages...", total=pTotalMensajes)
+    console=fConsolaRich()
+  )
 
-    async for vMessage in pClient.iter_messages("me", reverse=True, limit=pCfg.limit):
-      vIdsLote.append(vMessage.id)
+async def fBorrarMensajes(
+  pClient: TelegramClient,
+  pCfg: Config,
+  pTotalMensajes: int,
+  pIdReenvio: Optional[int] = None,
+  pDiario: Optional[DiarioBorrado] = None,
+  pMinId: int = 0,
+  pIdRemitente: Optional[int] = None
+) -> int:
+  from telethon.errors import FloodWaitError
 
-      if len(vIdsLote) >= 100:
-        await pClient.delete_messages("me", vIdsLote)
-        vContadorBorrados += len(vIdsLote)
-        vIdsLote = []
+  vContadorBorrados = 0
+  aErrores = []
+  vDetener = asyncio.Event()
+  # Cola acotada: si los borrados van por detrás, la lectura del historial se frena en lugar de acumular ids
+  vCola: asyncio.Queue = asyncio.Queue(maxsize=pCfg.workers * 2)
+  vRegulador = ReguladorBorrado(pCfg.workers)
+
+  # Con filtros locales el total de partida es la cota del servidor; se fija al terminar de leer el historial
+  vTotal = pTotalMensajes
+  vEsCota = fHayFiltrosLocales(pCfg)
+  vEncolados = 0
+
+  # Las esperas cortas las duerme Telethon dentro de la petición; se escuchan para frenar al resto también
+  vLoggerFlood = logging.getLogger(cLoggerFloodTelethon)
+  vManejadorFlood = ManejadorFloodWait(vRegulador)
+  vNivelAnterior = vLoggerFlood.level
+  vLoggerFlood.addHandler(vManejadorFlood)
+  if vLoggerFlood.getEffectiveLevel() > logging.INFO:
+    vLoggerFlood.setLevel(logging.INFO)
+
+  with fCrearProgress() as vProgress:
+    vTask = vProgress.add_task("Borrando Saved Messages...", total=vTotal)
+
+    async def fBorrarLote(paIds: list) -> None:
+      await vRegulador.fAdquirir()
+      try:
+        while True:
+          await vRegulador.fEsperarPausa()
+          vFloodWaitsAntes = vRegulador.flood_waits
+          vInicio = time.perf_counter()
+
+          try:
+            await pClient.delete_messages("me", paIds)
+          except FloodWaitError as e:
+            # Espera más larga que flood_sleep_threshold: se respeta, se baja el ritmo y se reintenta el mismo lote
+            vRegulador.fRegistrarFloodWait(e.seconds)
+            vProgress.update(vTask, description=f"Flood wait de {e.seconds}s, esperando...")
+            continue
+
+          vRegulador.fRegistrarExito(time.perf_counter() - vInicio, vFloodWaitsAntes)
+          return
+      finally:
+        await vRegulador.fLiberar()
+
+    async def fTrabajadorBorrado() -> None:
+      nonlocal vContadorBorrados
+
+      while True:
+        vLote = await vCola.get()
+        if vLote is None:
+          return
+
+        vNumeroLote, aIds = vLote
+
+        # Tras un fallo o una cancelación se vacía la cola sin borrar nada más
+        if vDetener.is_set():
+          continue
+
+        try:
+          await fBorrarLote(aIds)
+        except Exception as e:
+          aErrores.append(e)
+          vDetener.set()
+          continue
+
+        if pDiario is not None:
+          await pDiario.fEscribirAsincrono({"tipo": "lote", "n": vNumeroLote, "desde": aIds[0], "hasta": aIds[-1], "ids": len(aIds)})
+
+        # Solo cuenta lo que Telegram ha confirmado, así el total es correcto aunque otro lote falle
+        vContadorBorrados += len(aIds)
         vProgress.update(
           vTask,
-          description=f"Borrados {vContadorBorrados} de {pTotalMensajes}",
+          description=vRegulador.fDescripcion(vContadorBorrados, vTotal, vEsCota),
           completed=vContadorBorrados
         )
 
+    aTrabajadores = [asyncio.create_task(fTrabajadorBorrado()) for _ in range(pCfg.workers)]
+    vIdsLote = []
+    vNumeroLote = 0
+
+    try:
+      async for vRegistro in fIterarMensajesFiltrados(pClient, pCfg, pIdReenvio, pMinId, vRegulador, pIdRemitente):
+        if vDetener.is_set():
+          break
+
+        vIdsLote.append(vRegistro.id)
+        vEncolados += 1
+
+        if len(vIdsLote) >= vRegulador.tamano_lote:
+          await vCola.put((vNumeroLote, vIdsLote))
+          vIdsLote = []
+          vNumeroLote += 1
+
+      if vIdsLote and not vDetener.is_set():
+        await vCola.put((vNumeroLote, vIdsLote))
+
+      if not vDetener.is_set():
+        # Historial leído entero: ya se sabe cuántos mensajes cumplen los filtros
+        vTotal = vEncolados
+        vEsCota = False
+        vProgress.update(vTask, total=vTotal)
+    except BaseException:
+      vDetener.set()
+      raise
+    finally:
+      # Los borrados ya enviados terminan antes de salir para que el contador refleje lo que se borró de verdad
+      for _ in aTrabajadores:
+        await vCola.put(None)
+      await asyncio.gather(*aTrabajadores)
+
+      vLoggerFlood.removeHandler(vManejadorFlood)
+      vLoggerFlood.setLevel(vNivelAnterior)
+
+  if vRegulador.flood_waits:
+    console.print(
+      f"[yellow]Flood waits: {vRegulador.flood_waits} "
+      f"({vRegulador.segundos_frenado:.0f}s frenado por Telegram).[/yellow]"
+    )
+
+  if aErrores:
+    console.print(
+      f"[bold red]Error borrando un lote:[/bold red] {aErrores[0]} "
+      f"({vContadorBorrados} mensajes borrados antes del fallo)"
+    )
+    raise aErrores[0]
+
+  return vContadorBorrados
+
+async def fPlanificarBorrado(
+  pClient: TelegramClient,
+  pCfg: Config,
+  pTotalMensajes: int,
+  pIdReenvio: Optional[int] = None,
+  pMinId: int = 0,
+  pIdRemitente: Optional[int] = None
+) -> tuple[int, int]:
+  vLotes = 0
+  vIds = 0
+
+  vTotal = f"hasta {pTotalMensajes}" if fHayFiltrosLocales(pCfg) else pTotalMensajes
+
+  with fCrearProgress() as vProgress, DiarioBorrado(pCfg.dry_run, pSincronizar=False) as vPlan:
+    vTask = vProgress.add_task("Planificando el borrado...", total=pTotalMensajes)
+
+    def fAnotarLote(paIds: list) -> None:
+      nonlocal vLotes, vIds
+
+      vPlan.fEscribir({"tipo": "lote", "n": vLotes, "desde": paIds[0], "hasta": paIds[-1], "ids": len(paIds)})
+      vLotes += 1
+      vIds += len(paIds)
+      vProgress.update(vTask, description=f"Planificados {vIds} de {vTotal}", completed=vIds)
+
+    vIdsLote = []
+    async for vRegistro in fIterarMensajesFiltrados(pClient, pCfg, pIdReenvio, pMinId, pIdRemitente=pIdRemitente):
+      vIdsLote.append(vRegistro.id)
+
+      if len(vIdsLote) >= cTamanoLote:
+        fAnotarLote(vIdsLote)
+        vIdsLote = []
+
     if vIdsLote:
-      await pClient.delete_messages("me", vIdsLote)
-      vContadorBorrados += len(vIdsLote)
+      fAnotarLote(vIdsLote)
+    vProgress.update(vTask, total=vIds)
+
+    vPlan.fEscribir({"tipo": "resumen", "lotes": vLotes, "ids": vIds, "min_id": pMinId})
+
+  return vLotes, vIds
+
+async def fBorrarHistorial(
+  pClient: TelegramClient,
+  pTotalMensajes: int,
+  pMaxId: int,
+  pFechaMinima: Optional[datetime] = None,
+  pFechaMaxima: Optional[datetime] = None
+) -> int:
+  from telethon.tl.functions.messages import DeleteHistoryRequest
+
+  vContadorBorrados = 0
+
+  with fCrearProgress() as vProgress:
+    vTask = vProgress.add_task("Vaciando Saved Messages en el servidor...", total=pTotalMensajes)
+
+    # Telegram borra el historial por tramos y devuelve offset > 0 mientras quede algo por debajo de max_id
+    while True:
+      vResultado = await pClient(
+        DeleteHistoryRequest(peer="me", max_id=pMaxId, revoke=True, min_date=pFechaMinima, max_date=pFechaMaxima)
+      )
+      vContadorBorrados += vResultado.pts_count
       vProgress.update(
         vTask,
         description=f"Borrados {vContadorBorrados} de {pTotalMensajes}",
-        completed=vContadorBorrados
+        completed=min(vContadorBorrados, pTotalMensajes)
       )
 
+      if vResultado.offset <= 0:
+        break
+
   return vContadorBorrados
 
-async def fContarMensajes(pClient: TelegramClient) -> int:
-  vResultado = await pClient.get_messages("me", limit=0)
+async def fPedirConEspera(pFuncion, *pArgs, **pKwargs):
+  from telethon.errors import FloodWaitError
+
+  # Las peticiones sueltas del recuento también esperan los flood waits largos en vez de abortar
+  while True:
+    try:
+      return await pFuncion(*pArgs, **pKwargs)
+    except FloodWaitError as e:
+      await asyncio.sleep(e.seconds)
+
+async def fContarMensajes(
+  pClient: TelegramClient,
+  pCfg: Optional[Config] = None,
+  pMinId: int = 0
+) -> int:
+  """Mensajes que cumplen los filtros. Con filtros locales es una cota: lo que deja pasar el servidor."""
+  if pCfg is not None and fHayFiltros(pCfg):
+    if fHayFiltrosLocales(pCfg):
+      # Contarlos exactamente costaría recorrer el historial una vez más antes de borrar; el borrado fija el total
+      pCfg = replace(
+        pCfg,
+        match=None,
+        forwarded_from=None,
+        from_user=None,
+        media=pCfg.media if pCfg.media is not None and dFiltrosMedia[pCfg.media] is not None else None
+      )
+
+    # Lo que sabe filtrar el servidor: una búsqueda con limit=0 devuelve solo el recuento
+    from telethon.tl.functions.messages import SearchRequest
+    from telethon.tl.types import InputMessagesFilterEmpty
+
+    vResultado = await fPedirConEspera(pClient, SearchRequest(
+      peer="me",
+      q=pCfg.search or "",
+      filter=fFiltroTelegram(pCfg) or InputMessagesFilterEmpty(),
+      min_date=pCfg.after,
+      max_date=pCfg.before,
+      offset_id=0,
+      add_offset=0,
+      limit=0,
+      max_id=0,
+      min_id=pMinId,
+      hash=0
+    ))
+    return getattr(vResultado, "count", None) or len(getattr(vResultado, "messages", []))
+
+  vResultado = await fPedirConEspera(pClient.get_messages, "me", limit=0)
   vTotal = getattr(vResultado, "total", None)
 
   if vTotal is None:
-    vResultado = await pClient.get_messages("me", limit=1)
+    vResultado = await fPedirConEspera(pClient.get_messages, "me", limit=1)
     vTotal = getattr(vResultado, "total", 0) or 0
 
   return vTotal
 
-async def fEjecutar(pCfg: Config) -> int:
+async def fEjecutar(pCfg: Config, pClient: Optional[TelegramClient] = None) -> int:
+  from rich.panel import Panel
+
   console.print(
     Panel.fit(
       "[bold green]Telegram Saved Messages Eraser[/bold green]\n"
@@ -287,16 +1055,54 @@ async def fEjecutar(pCfg: Config) -> int:
     )
   )
 
-  vClient = TelegramClient(pCfg.session, pCfg.api_id, pCfg.api_hash)
+  # pClient: conexión ya abierta y con sesión iniciada (la del demonio), que no se cierra al terminar
+  vClient = pClient or fCrearCliente(pCfg)
   vTotalBorrados = 0
 
-  try:
-    await vClient.connect()
-    await fAsegurarLogin(vClient, pCfg)
+  # DeleteHistory solo sabe de tope de id y rango de fechas; cualquier otro filtro o --limit va por lotes de ids
+  vBulkPosible = pCfg.limit is None and not any(
+    vValor is not None
+    for vValor in (pCfg.media, pCfg.from_user, pCfg.forwarded_from, pCfg.search, pCfg.match)
+  )
 
-    console.print("[cyan]Contando mensajes en Saved Messages...[/cyan]")
-    vTotalMensajes = await fContarMensajes(vClient)
-    console.print(f"[cyan]Total de mensajes en Saved Messages: [bold]{vTotalMensajes}[/bold][/cyan]\n")
+  try:
+    if pClient is None:
+      await vClient.connect()
+      await fAsegurarLogin(vClient, pCfg)
+
+    vIdReenvio = await fResolverReenvio(vClient, pCfg)
+    vIdRemitente = await fResolverRemitente(vClient, pCfg)
+
+    # Un borrado por lotes que quedó a medias se reanuda justo después del último tramo confirmado
+    vdFirma = fFirmaFiltros(pCfg)
+    vMinId, vBorradosPrevios = 0, 0
+    if pCfg.resume and not (pCfg.bulk and vBulkPosible):
+      vMinId, vBorradosPrevios = fLeerPuntoDeReanudacion(pCfg.journal, vdFirma)
+
+    if vMinId or vBorradosPrevios:
+      console.print(
+        f"[cyan]Reanudando desde el id {vMinId} ({vBorradosPrevios} mensajes ya borrados según {pCfg.journal}).[/cyan]"
+      )
+      if pCfg.limit is not None:
+        pCfg = replace(pCfg, limit=max(0, pCfg.limit - vBorradosPrevios))
+
+    # --after se recorre como un min_id, igual que la reanudación: así vale también con --search, --media y --from-user
+    vMinIdDesde = max(vMinId, await fIdDesdeFecha(vClient, pCfg.after))
+
+    if fHayFiltros(pCfg):
+      console.print("[cyan]Contando mensajes que cumplen los filtros...[/cyan]")
+      vTotalMensajes = await fContarMensajes(vClient, pCfg, vMinIdDesde)
+      if fHayFiltrosLocales(pCfg):
+        console.print(
+          f"[cyan]Mensajes que pueden cumplir los filtros: [bold]hasta {vTotalMensajes}[/bold] "
+          f"(el número exacto se sabe al recorrer el historial).[/cyan]\n"
+        )
+      else:
+        console.print(f"[cyan]Mensajes que cumplen los filtros: [bold]{vTotalMensajes}[/bold][/cyan]\n")
+    else:
+      console.print("[cyan]Contando mensajes en Saved Messages...[/cyan]")
+      vTotalMensajes = await fContarMensajes(vClient)
+      console.print(f"[cyan]Total de mensajes en Saved Messages: [bold]{vTotalMensajes}[/bold][/cyan]\n")
 
     vTotalABorrar = vTotalMensajes
     if pCfg.limit is not None and pCfg.limit < vTotalMensajes:
@@ -304,12 +1110,52 @@ async def fEjecutar(pCfg: Config) -> int:
       console.print(f"[yellow]Se borrarán solo {vTotalABorrar} mensajes (límite aplicado).[/yellow]\n")
 
     if vTotalABorrar == 0:
+      if (vMinId or vBorradosPrevios) and not pCfg.dry_run:
+        # El borrado que quedó a medias ya no tiene nada pendiente: se cierra para no reanudarlo más
+        with DiarioBorrado(pCfg.journal) as vDiario:
+          vDiario.fEscribir({"tipo": "fin", "borrados": vBorradosPrevios})
       console.print("[green]No hay mensajes para borrar.[/green]")
       return 0
 
-    vTotalBorrados = await fBorrarMensajes(vClient, pCfg, vTotalABorrar)
+    if pCfg.dry_run:
+      vLotes, vIdsPlaneados = await fPlanificarBorrado(
+        vClient, pCfg, vTotalABorrar, vIdReenvio, vMinIdDesde, pIdRemitente=vIdRemitente
+      )
+      console.print(
+        Panel.fit(
+          f"[bold]Mensajes que se borrarían:[/bold] {vIdsPlaneados}\n"
+          f"[bold]Lotes:[/bold] {vLotes}\n"
+          f"[bold]Plan:[/bold] {pCfg.dry_run}",
+          title="Simulación (no se ha borrado nada)",
+          border_style="yellow"
+        )
+      )
+      return 0
+
+    if pCfg.bulk and vBulkPosible:
+      # Tope en el mensaje más reciente de ahora: lo que llegue mientras se vacía el chat no se toca
+      aUltimo = await vClient.get_messages("me", limit=1)
+      vTotalBorrados = await fBorrarHistorial(
+        vClient, vTotalABorrar, aUltimo[0].id if aUltimo else 0, pCfg.after, pCfg.before
+      )
+    else:
+      if pCfg.bulk:
+        console.print("[yellow]--bulk solo admite --after/--before/--keep-days; con otros filtros o --limit se borra por lotes de ids.[/yellow]\n")
+      with DiarioBorrado(pCfg.journal) as vDiario:
+        vDiario.fEscribir({
+          "tipo": "inicio",
+          "fecha": datetime.now().astimezone().isoformat(),
+          "firma": vdFirma,
+          "min_id": vMinIdDesde,
+          "borrados_previos": vBorradosPrevios
+        })
+        vTotalBorrados = await fBorrarMensajes(
+          vClient, pCfg, vTotalABorrar, vIdReenvio, vDiario, vMinIdDesde, pIdRemitente=vIdRemitente
+        )
+        vDiario.fEscribir({"tipo": "fin", "borrados": vBorradosPrevios + vTotalBorrados})
   finally:
-    await vClient.disconnect()
+    if pClient is None:
+      await vClient.disconnect()
 
   console.print(
     Panel.fit(
@@ -321,9 +1167,62 @@ async def fEjecutar(pCfg: Config) -> int:
 
   return 0
 
+def fEjecutarEnDemonio(pTipo: str, paArgumentos: list[str]) -> Optional[int]:
+  """Manda el trabajo a tsmdaemon.py si está en marcha. Devuelve None si no hay demonio o no puede atenderlo."""
+  if not cRutaSocketDemonio.exists():
+    return None
+
+  vSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    vSocket.connect(str(cRutaSocketDemonio))
+  except OSError:
+    # Socket huérfano de un demonio que ya no está en marcha
+    vSocket.close()
+    return None
+
+  dPeticion = {
+    "tipo": pTipo,
+    "argumentos": paArgumentos,
+    "cwd": os.getcwd(),
+    "tty": sys.stdout.isatty(),
+    "ancho": shutil.get_terminal_size().columns
+  }
+
+  with vSocket, vSocket.makefile("rwb") as vCanal:
+    vCanal.write((json.dumps(dPeticion) + "\n").encode("utf-8"))
+    vCanal.flush()
+
+    for vLinea in vCanal:
+      dMensaje = json.loads(vLinea)
+
+      if dMensaje["tipo"] == "salida":
+        sys.stdout.write(dMensaje["texto"])
+        sys.stdout.flush()
+      elif dMensaje["tipo"] == "rechazado":
+        print(f"[INFO] El demonio no puede atender este trabajo ({dMensaje['motivo']}); se ejecuta aquí.", file=sys.stderr)
+        return None
+      elif dMensaje["tipo"] == "fin":
+        return dMensaje["codigo"]
+
+  print("[ERROR] El demonio cerró la conexión sin terminar el trabajo.", file=sys.stderr)
+  return 1
+
 def main() -> None:
   vCfg = fParsearArgumentos()
 
+  # Si hay un demonio en marcha se le manda el trabajo (sin cargar rich ni telethon aquí)
+  if not vCfg.no_daemon:
+    try:
+      vCodigo = fEjecutarEnDemonio("erase", sys.argv[1:])
+    except KeyboardInterrupt:
+      print("\nCancelado por el usuario.", file=sys.stderr)
+      raise SystemExit(130)
+
+    if vCodigo is not None:
+      raise SystemExit(vCodigo)
+
+  fAsegurarDependencias()
+
   try:
     raise SystemExit(asyncio.run(fEjecutar(vCfg)))
   except KeyboardInterrupt: